@@ -0,0 +1,118 @@
+import hashlib
+import datetime
+from typing import List, Optional, Any
+
+from inference import parse_value, BigInt
+
+# a column is clustered when at least this share of neighbouring rows is in order, in either direction.
+CLUSTERED = 0.9
+# a column is a lookup column when at least this share of the sampled values is distinct.
+HIGH_CARDINALITY = 0.5
+# with no more distinct values than this, any one value matches too many rows for an index to pay off.
+FEW_VALUES = 16
+# postgres' default_statistics_target, and the most it allows.
+DEFAULT_STATISTICS_TARGET = 100
+MAX_STATISTICS_TARGET = 10000
+
+ORDERED_TYPES = (int, BigInt, float, datetime.date, datetime.datetime)
+# NAMEDATALEN - 1: postgres silently truncates longer identifiers.
+MAX_IDENTIFIER_BYTES = 63
+
+
+class ColumnProfile(object):
+    """ what the advisor needs to know about one sampled column. """
+    def __init__(self, name, python_type, num_rows, distinct, nulls, sortedness, is_key=False):
+        # type: (str, type, int, int, int, float, bool)->None
+        self.name = name
+        self.python_type = python_type
+        self.num_rows = num_rows
+        self.distinct = distinct  # distinct non-null values.
+        self.nulls = nulls
+        self.sortedness = sortedness
+        self.is_key = is_key
+
+    @property
+    def cardinality(self):
+        # type: ()->float
+        non_null = self.num_rows - self.nulls
+        return float(self.distinct) / non_null if non_null > 0 else 0.0
+
+
+class Recommendation(object):
+    def __init__(self, column, kind, reason, statistics_target=None):
+        # type: (str, str, str, Optional[int])->None
+        self.column = column
+        self.kind = kind  # "brin", "btree", "hash" or "statistics".
+        self.reason = reason
+        self.statistics_target = statistics_target
+
+
+def sortedness(values):
+    # type: (List[Any])->float
+    """ the share of neighbouring values that are in order, ascending or descending, whichever is larger. """
+    if len(values) < 2:
+        return 0.0
+    pairs = list(zip(values, values[1:]))
+    ascending = sum([1 for a, b in pairs if a <= b])
+    descending = sum([1 for a, b in pairs if a >= b])
+    return float(max(ascending, descending)) / len(pairs)
+
+
+def profile_column(name, python_type, dictionary, codes, null_values, is_key=False):
+    # type: (str, type, List[str], Any, List[str], bool)->ColumnProfile
+    """
+    profiles a dictionary-encoded column: each distinct value is parsed once, and the codes, in file order,
+    give the order of the rows.
+    """
+    nulls = set([code for code, value in enumerate(dictionary) if value in null_values])
+    parsed = [None if code in nulls else parse_value(python_type, value) for code, value in enumerate(dictionary)]
+    ordered = [parsed[code] for code in codes if parsed[code] is not None]
+    return ColumnProfile(
+        name, python_type,
+        num_rows=len(codes),
+        distinct=len(dictionary) - len(nulls),
+        nulls=sum([1 for code in codes if code in nulls]),
+        sortedness=sortedness(ordered) if python_type in ORDERED_TYPES else 0.0,
+        is_key=is_key,
+    )
+
+
+def index_name(table, column, kind):
+    # type: (str, str, str)->str
+    """
+    `<table>_<column>_<kind>`, cut to fit in an identifier. a cut name ends in a hash of the whole one, so
+    two long names that share a prefix don't truncate to the same index and skip each other's IF NOT EXISTS.
+    """
+    name = "%s_%s_%s" % (table, column, kind)
+    encoded = name.encode("utf8")
+    if len(encoded) <= MAX_IDENTIFIER_BYTES:
+        return name
+    suffix = "_" + hashlib.sha256(encoded).hexdigest()[:8]
+    # cut on a character boundary.
+    prefix = encoded[:MAX_IDENTIFIER_BYTES - len(suffix)].decode("utf8", errors="ignore")
+    return prefix + suffix
+
+
+def recommend(profile):
+    # type: (ColumnProfile)->List[Recommendation]
+    recommendations = list()
+    if profile.distinct < 2:
+        return recommendations
+    if profile.sortedness >= CLUSTERED:
+        # the rows are stored in about the column's order, so block ranges are enough to skip most of the table.
+        recommendations.append(Recommendation(profile.name, "brin", "%.0f%% of neighbouring rows are in order" % (
+            100 * profile.sortedness)))
+    elif profile.cardinality >= HIGH_CARDINALITY or profile.is_key:
+        recommendations.append(Recommendation(profile.name, "btree", "%d distinct values in %d rows" % (
+            profile.distinct, profile.num_rows - profile.nulls)))
+    elif profile.distinct > FEW_VALUES and profile.python_type == str:
+        # equality is all that's asked of a low-cardinality text column, and a hash index stores no keys.
+        recommendations.append(Recommendation(profile.name, "hash", "%d distinct values, only compared for equality" % (
+            profile.distinct)))
+
+    if DEFAULT_STATISTICS_TARGET < profile.distinct and profile.cardinality < HIGH_CARDINALITY:
+        # enough most-common values and histogram buckets to tell the frequent values apart.
+        target = min(MAX_STATISTICS_TARGET, -(-profile.distinct // 100) * 100)
+        recommendations.append(Recommendation(profile.name, "statistics", "%d distinct, repeated values" % (
+            profile.distinct), statistics_target=target))
+    return recommendations
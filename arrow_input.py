@@ -0,0 +1,131 @@
+import os
+import sys
+from typing import List, Optional, Iterator, Any, Tuple
+
+from progress import Progress, metrics_file_from_environment
+
+# pyarrow is only needed for Parquet and Arrow files, so it's imported when one is read.
+
+PARQUET_SUFFIXES = (".parquet", ".pq")
+ARROW_SUFFIXES = (".arrow", ".feather", ".ipc")
+DEFAULT_BATCH_SIZE = 65536
+
+
+def is_columnar_file(filepath):
+    # type: (str)->bool
+    """ by suffix, or else by the magic bytes Parquet and Arrow IPC files start with. """
+    if filepath.lower().endswith(PARQUET_SUFFIXES + ARROW_SUFFIXES):
+        return True
+    with open(filepath, 'rb') as f:
+        magic = f.read(6)
+    return magic[:4] == b"PAR1" or magic == b"ARROW1"
+
+
+def open_batches(filepath, columns=None, batch_size=DEFAULT_BATCH_SIZE):
+    # type: (str, Optional[List[str]], int)->Tuple[Any, Iterator[Any]]
+    """ the schema of the selected columns, and an iterator over record batches, read one at a time. """
+    import pyarrow.parquet
+    import pyarrow.ipc
+    with open(filepath, 'rb') as f:
+        is_parquet = f.read(4) == b"PAR1"
+    if is_parquet:
+        parquet_file = pyarrow.parquet.ParquetFile(filepath)
+        schema = parquet_file.schema_arrow
+        if columns is not None:
+            schema = pyarrow.schema([schema.field(c) for c in columns])
+        return schema, parquet_file.iter_batches(batch_size=batch_size, columns=columns)
+    try:
+        reader = pyarrow.ipc.open_file(filepath)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pyarrow.ArrowInvalid:
+        reader = pyarrow.ipc.open_stream(filepath)
+        batches = iter(reader)
+    schema = reader.schema
+    if columns is not None:
+        schema = pyarrow.schema([schema.field(c) for c in columns])
+        batches = (batch.select(columns) for batch in batches)
+    return schema, batches
+
+
+def sql_type(arrow_type):
+    # type: (Any)->str
+    import pyarrow.types as t
+    if t.is_dictionary(arrow_type):
+        return sql_type(arrow_type.value_type)
+    if t.is_int8(arrow_type) or t.is_int16(arrow_type) or t.is_uint8(arrow_type):
+        return "SMALLINT"
+    if t.is_int32(arrow_type) or t.is_uint16(arrow_type):
+        return "INTEGER"
+    if t.is_int64(arrow_type) or t.is_uint32(arrow_type):
+        return "BIGINT"
+    if t.is_uint64(arrow_type):
+        return "NUMERIC(20, 0)"
+    if t.is_float16(arrow_type) or t.is_float32(arrow_type):
+        return "REAL"
+    if t.is_float64(arrow_type):
+        return "DOUBLE PRECISION"
+    if t.is_decimal(arrow_type):
+        return "NUMERIC(%d, %d)" % (arrow_type.precision, arrow_type.scale)
+    if t.is_boolean(arrow_type):
+        return "BOOLEAN"
+    if t.is_date(arrow_type):
+        return "DATE"
+    if t.is_timestamp(arrow_type):
+        return "TIMESTAMP" if arrow_type.tz is None else "TIMESTAMPTZ"
+    if t.is_time(arrow_type):
+        return "TIME"
+    if t.is_string(arrow_type) or t.is_large_string(arrow_type) or t.is_null(arrow_type):
+        return "TEXT"
+    if _is_binary(arrow_type):
+        return "BYTEA"
+    raise TypeError("Arrow type '%s' has no postgres equivalent; leave the column out with --columns." % arrow_type)
+
+
+def _is_binary(arrow_type):
+    # type: (Any)->bool
+    import pyarrow.types as t
+    return t.is_binary(arrow_type) or t.is_large_binary(arrow_type) or t.is_fixed_size_binary(arrow_type)
+
+
+def _hex_binary_columns(batch):
+    # type: (Any)->Any
+    """ the CSV writer would write raw bytes, so binary columns go in postgres' hex format instead. """
+    import pyarrow
+    arrays = list()
+    for field, array in zip(batch.schema, batch.columns):
+        if _is_binary(field.type):
+            array = pyarrow.array([None if v is None else "\\x" + v.hex() for v in array.to_pylist()], pyarrow.string())
+        arrays.append(array)
+    return pyarrow.RecordBatch.from_arrays(arrays, names=batch.schema.names)
+
+
+def write_csv(filepath, out, columns=None, batch_size=DEFAULT_BATCH_SIZE):
+    # type: (str, Any, Optional[List[str]], int)->int
+    """
+    streams the file to `out` as headerless CSV, one record batch at a time. the values are formatted by
+    arrow's CSV writer, column by column in C++, never as python objects (except binary columns).
+    nulls are written as empty fields and empty strings as "", which is what COPY's CSV format expects.
+    returns the number of rows.
+    """
+    import pyarrow
+    import pyarrow.csv
+    schema, batches = open_batches(filepath, columns, batch_size)
+    has_binary = any([_is_binary(f.type) for f in schema])
+    if has_binary:
+        schema = pyarrow.schema([pyarrow.field(f.name, pyarrow.string()) if _is_binary(f.type) else f for f in schema])
+    progress = Progress("Streaming %s" % os.path.basename(filepath), total_bytes=None,
+                        metrics_file=metrics_file_from_environment())
+    with pyarrow.csv.CSVWriter(out, schema, write_options=pyarrow.csv.WriteOptions(include_header=False)) as writer:
+        for batch in batches:
+            writer.write_batch(_hex_binary_columns(batch) if has_binary else batch)
+            progress.advance(batch.nbytes)
+            progress.update(rows=batch.num_rows)
+    progress.finish()
+    return progress.rows
+
+
+if __name__ == '__main__':
+    # usage: python arrow_input.py <parquet or arrow file> [comma-separated column names]
+    # writes the rows to stdout as CSV, so psql's `\copy ... FROM PROGRAM` can load them.
+    write_csv(sys.argv[1], sys.stdout.buffer, sys.argv[2].split(",") if len(sys.argv) > 2 else None)
+    sys.stdout.buffer.flush()
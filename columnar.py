@@ -0,0 +1,143 @@
+import math
+from array import array
+from collections import Counter
+from itertools import zip_longest, islice
+from typing import List, Dict, Iterable, Tuple, Sequence, Optional, Callable
+
+
+class ColumnStatistics(object):
+    """
+    the statistics of a column's values at one point in time, all computed together from one count per code.
+    entropies are in nats: `entropy` is the column's, `entropy_if_uniform` what it would be if its distinct
+    values were equally frequent, and `max_entropy` what it would be if every value were distinct.
+    """
+    def __init__(self, encoded, null_values=()):
+        # type: (EncodedColumn, Sequence[str])->None
+        self.null_values = tuple(null_values)
+        self.rows = len(encoded)
+        self.code_counts = Counter(encoded.codes)
+        # indexed by code: codes are numbered in the order their values were first seen.
+        self.counts = array('l', [self.code_counts[code] for code in range(len(encoded.dictionary))])
+        self.distinct = len(self.counts)
+        self.nulls = sum([self.counts[encoded.code_of(v)] for v in self.null_values if encoded.code_of(v) is not None])
+        self.entropy = self.entropy_if_uniform = self.max_entropy = 0.0
+        if self.rows > 0:
+            n = float(self.rows)
+            self.entropy = sum([(count / n) * -math.log(count / n, math.e) for count in self.counts])
+            p = (n / self.distinct) / n
+            self.entropy_if_uniform = sum([p * -math.log(p, math.e)] * self.distinct)
+            p = 1.0 / n
+            self.max_entropy = p * -math.log(p, math.e) * n
+
+    def frequencies(self, dictionary):
+        # type: (List[str])->Dict[str, int]
+        return {dictionary[code]: n for code, n in enumerate(self.counts)}
+
+
+class EncodedColumn(object):
+    """
+    one column of a sample, dictionary-encoded: every distinct value is kept once, in `dictionary`,
+    and each row holds only the integer code of its value in `codes`.
+    """
+    def __init__(self):
+        self.dictionary = list()  # type: List[str]
+        self.codes = array('l')
+        self.__lookup = dict()  # type: Dict[str, int]
+        self.__statistics = None  # type: Optional[ColumnStatistics]
+
+    def extend(self, values):
+        # type: (Iterable[str])->None
+        self.__statistics = None
+        lookup = self.__lookup
+        setdefault = lookup.setdefault
+        # `len(lookup)` is evaluated before `setdefault` inserts, so a new value gets the next code.
+        self.codes.extend([setdefault(v, len(lookup)) for v in values])
+        if len(lookup) > len(self.dictionary):
+            self.dictionary.extend(islice(lookup, len(self.dictionary), None))
+
+    def append(self, value):
+        # type: (str)->None
+        self.extend((value,))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def code_of(self, value):
+        # type: (str)->Optional[int]
+        return self.__lookup.get(value)
+
+    def statistics(self, null_values=None):
+        # type: (Optional[Sequence[str]])->ColumnStatistics
+        """ computed on first use, and again only after values were added or to count other null values. """
+        current = self.__statistics
+        if current is None or (null_values is not None and current.null_values != tuple(null_values)):
+            current = self.__statistics = ColumnStatistics(self, null_values or ())
+        return current
+
+    def code_counts(self):
+        # type: ()->Counter
+        return Counter(self.statistics().code_counts)
+
+    def value_counts(self):
+        # type: ()->Dict[str, int]
+        return self.statistics().frequencies(self.dictionary)
+
+    def values(self):
+        # type: ()->List[str]
+        dictionary = self.dictionary
+        return [dictionary[code] for code in self.codes]
+
+    def value_counts_between(self, start, end):
+        # type: (int, int)->Dict[str, int]
+        """ the value counts of rows [start, end) only. """
+        dictionary = self.dictionary
+        return {dictionary[code]: n for code, n in Counter(self.codes[start:end]).items()}
+
+
+class SampleStore(object):
+    """ the sampled rows of a table, held as one `EncodedColumn` per column instead of a list of rows. """
+    batch_size = 4096
+
+    def __init__(self, num_columns):
+        # type: (int)->None
+        self.columns = [EncodedColumn() for _ in range(num_columns)]
+        self.num_rows = 0
+
+    def append_rows(self, rows):
+        # type: (Sequence[List[str]])->None
+        """ transposes a batch of rows in C. rows that are too short are padded with empty strings. """
+        transposed = zip_longest(*rows, fillvalue="")
+        # columns that no row of the batch reaches, blank lines included, get an empty string for every row.
+        padding = ("",) * len(rows)
+        for column in self.columns:
+            column.extend(next(transposed, padding))
+        self.num_rows += len(rows)
+
+    def load(self, reader, limit, until=None, batch_size=None):
+        # type: (Iterable[List[str]], int, Optional[Callable[[int, int], bool]], Optional[int])->int
+        """
+        reads up to `limit` rows from `reader` in batches, so only one batch of row lists is alive at a time.
+        with `until`, it's called with the first and the end row number of each batch once the batch is stored,
+        and reading stops when it returns true.
+        """
+        batch_size = batch_size or self.batch_size
+        batch = list()
+        for row in reader:
+            batch.append(row)
+            if len(batch) >= batch_size or self.num_rows + len(batch) >= limit:
+                start = self.num_rows
+                self.append_rows(batch)
+                batch = list()
+                if self.num_rows >= limit or (until is not None and until(start, self.num_rows)):
+                    break
+        if len(batch):
+            start = self.num_rows
+            self.append_rows(batch)
+            if until is not None:
+                until(start, self.num_rows)
+        return self.num_rows
+
+    def key_counts(self, column_positions):
+        # type: (List[int])->Counter
+        """ how often each combination of values occurs in the given columns, keyed by tuples of codes. """
+        return Counter(zip(*[self.columns[p].codes for p in column_positions]))
@@ -0,0 +1,316 @@
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from typing import List, Tuple, Optional, Any
+
+from core import Server, PGPassEntry, connect, logger
+
+DEFAULT_INTERVAL = 1.0
+# a COPY that hasn't moved for this long is reported as stalled, with what it's waiting for.
+DEFAULT_STALL_SECONDS = 5.0
+
+# one round trip per poll. pg_stat_progress_copy is postgres 14+, and its row is gone once the COPY ends.
+# WAL is only counted per cluster before postgres 18, so other sessions' writes are included.
+POLL_QUERY = """
+    SELECT a.state, a.wait_event_type, a.wait_event, pg_blocking_pids(a.pid),
+           p.command, p.relid::regclass::text, p.bytes_processed, p.bytes_total, p.tuples_processed,
+           p.tuples_excluded, pg_wal_lsn_diff(pg_current_wal_insert_lsn(), '0/0')::bigint
+    FROM pg_stat_activity a
+    LEFT JOIN pg_stat_progress_copy p ON p.pid = a.pid
+    WHERE a.pid = %s;"""
+
+FIND_QUERY = r"""
+    SELECT pid FROM pg_stat_progress_copy WHERE command = 'COPY FROM'
+    UNION
+    SELECT pid FROM pg_stat_activity
+    WHERE state = 'active' AND wait_event_type = 'Lock' AND query ~* '^\s*copy\s+[^(].*\mfrom\M'
+    ORDER BY pid LIMIT 1;"""
+
+
+class CopySample(object):
+    """ what the loading backend was doing at one poll. """
+    def __init__(self, elapsed, row):
+        # type: (float, Tuple)->None
+        """ `row` is a row of `POLL_QUERY`; the progress columns are None while the backend isn't copying. """
+        self.elapsed = elapsed
+        (self.state, self.wait_event_type, self.wait_event, self.blocked_by, self.command, self.relation,
+         self.bytes_processed, self.bytes_total, self.tuples_processed, self.tuples_excluded, self.wal_position) = row
+
+    @property
+    def copying(self):
+        # type: ()->bool
+        return self.command is not None
+
+    @property
+    def loading(self):
+        # type: ()->bool
+        """ a COPY only shows up in pg_stat_progress_copy once it has its lock on the table, so wait for it too. """
+        return self.copying or (self.state == "active" and self.bound_by == "lock")
+
+    @property
+    def bound_by(self):
+        # type: ()->str
+        """
+        "client" while the backend waits for data from the client, "lock" while another session holds a lock
+        it needs, "io" while it waits for disk or WAL writes, and "server" while it's busy parsing and inserting.
+        """
+        if self.wait_event_type == "Client":
+            return "client"
+        if self.wait_event_type == "Lock" or any(self.blocked_by or []):
+            return "lock"
+        if self.wait_event_type == "IO":
+            return "io"
+        if self.wait_event_type == "LWLock" and (self.wait_event or "").startswith("WAL"):
+            return "io"
+        return "server"
+
+    def serialize(self):
+        return dict(self.__dict__)
+
+
+class LoadRecord(object):
+    """ the performance record of one load, as seen from the server. """
+    def __init__(self, server, pid, label=None, relation=None):
+        # type: (Server, int, Optional[str], Optional[str])->None
+        self.server = server
+        self.pid = pid
+        self.label = label
+        self.relation = relation
+        self.started = time.time()
+        self.samples = list()  # type: List[CopySample]
+        self.stalls = list()  # type: List[dict]
+
+    @property
+    def load_samples(self):
+        # type: ()->List[CopySample]
+        return [s for s in self.samples if s.loading]
+
+    def copies(self):
+        # type: ()->List[CopySample]
+        """
+        the last sample of each COPY the backend ran. a load can run several, one after the other; a new one
+        starts at zero, and the counters of the one before are last seen at its last poll.
+        """
+        ends = list()
+        last = None  # type: Optional[CopySample]
+        for sample in self.samples:
+            if last is not None and last.copying:
+                restarted = (sample.tuples_processed or 0) < (last.tuples_processed or 0)
+                if not sample.copying or sample.relation != last.relation or restarted:
+                    ends.append(last)
+            last = sample
+        if last is not None and last.copying:
+            ends.append(last)
+        return ends
+
+    @property
+    def bound_by(self):
+        # type: ()->Optional[str]
+        """ what the backend waited on most while it was loading. """
+        counts = Counter([s.bound_by for s in self.load_samples])
+        return counts.most_common(1)[0][0] if any(counts) else None
+
+    def summary(self):
+        # type: ()->dict
+        samples = self.load_samples
+        seconds = samples[-1].elapsed - samples[0].elapsed if any(samples) else 0.0
+        copies = self.copies()
+        # as of the last poll of each COPY: what it did after that isn't seen.
+        tuples = sum([c.tuples_processed or 0 for c in copies])
+        bytes_processed = sum([c.bytes_processed or 0 for c in copies])
+        # only while loading: a session watched until it disconnects may sit idle for long after its COPY.
+        wal = samples[-1].wal_position - samples[0].wal_position if any(samples) else 0
+        return {
+            "label": self.label,
+            "server": self.server.name,
+            "pid": self.pid,
+            "started": self.started,
+            "relation": self.relation or (copies[-1].relation if any(copies) else None),
+            "copies": len(copies),
+            "seconds": seconds,
+            "tuples": tuples,
+            "bytes": bytes_processed,
+            "tuples_per_second": tuples / seconds if seconds > 0 else None,
+            "bytes_per_second": bytes_processed / seconds if seconds > 0 else None,
+            "wal_bytes": wal,
+            "wait_shares": {k: float(n) / len(samples) for k, n in Counter([s.bound_by for s in samples]).items()},
+            "bound_by": self.bound_by,
+            "stalls": self.stalls,
+        }
+
+    def to_line(self):
+        # type: ()->str
+        s = self.summary()
+        return "%s: %d tuples, %.1f MB in %.1fs (%s tuples/s), %.1f MB of WAL, %d stall(s); mostly %s-bound." % (
+            s["relation"] or "COPY", s["tuples"], s["bytes"] / (1024.0 * 1024.0), s["seconds"],
+            "%.0f" % s["tuples_per_second"] if s["tuples_per_second"] else "-", s["wal_bytes"] / (1024.0 * 1024.0),
+            len(s["stalls"]), s["bound_by"] or "not")
+
+    def save(self, path, include_samples=False):
+        # type: (str, bool)->None
+        """ appends the record to `path` as one json line, so repeated loads build up a history. """
+        record = self.summary()
+        if include_samples:
+            record["samples"] = [s.serialize() for s in self.samples]
+        with open(path, 'a', encoding='utf8') as f:
+            f.write(json.dumps(record) + "\n")
+
+
+class CopyMonitor(object):
+    """
+    watches another backend's COPY from a second connection: it polls the backend's row in
+    pg_stat_progress_copy, its wait event and the sessions blocking it, and the WAL position, every `interval`
+    seconds until `stop()` is called or the backend goes away. with `log_progress`, every poll goes to `logger`;
+    a COPY that hasn't processed any bytes or tuples for `stall_seconds` is always logged as stalled, with what
+    it's waiting on.
+    a table created in the loading transaction isn't visible to the monitor's session, so its name can't be
+    looked up until the commit: pass `relation` to name it.
+    """
+    def __init__(self, server, credential, pid, interval=DEFAULT_INTERVAL, stall_seconds=DEFAULT_STALL_SECONDS,
+                 label=None, relation=None, log_progress=True):
+        # type: (Server, PGPassEntry, int, float, float, Optional[str], Optional[str], bool)->None
+        self.server = server
+        self.credential = credential
+        self.interval = interval
+        self.stall_seconds = stall_seconds
+        self.log_progress = log_progress
+        self.record = LoadRecord(server, pid, label, relation)
+        self.error = None  # type: Optional[Exception]
+        self.__stop = threading.Event()
+        self.__thread = None  # type: Optional[threading.Thread]
+
+    def start(self):
+        # type: ()->CopyMonitor
+        self.__thread = threading.Thread(target=self.run, name="copy-monitor-%d" % self.record.pid, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        # type: ()->LoadRecord
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+        return self.record
+
+    def run(self):
+        # type: ()->LoadRecord
+        try:
+            connection = connect(self.server, self.credential, application_name="psql_utils_copy_monitor")
+        except Exception as e:
+            logger.error("Can't monitor the load: %s" % e)
+            self.error = e
+            return self.record
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                self.poll(cursor)
+        except Exception as e:
+            logger.error("Monitoring the load failed: %s" % e)
+            self.error = e
+        finally:
+            connection.close()
+        return self.record
+
+    def poll(self, cursor):
+        # type: (Any)->None
+        started = time.perf_counter()
+        moved_at = started
+        last = None  # type: Optional[CopySample]
+        stalled = False
+        while True:
+            cursor.execute(POLL_QUERY, (self.record.pid,))
+            row = cursor.fetchone()
+            if row is None:
+                # the backend disconnected.
+                break
+            now = time.perf_counter()
+            sample = CopySample(now - started, row)
+            self.record.samples.append(sample)
+            if sample.loading:
+                moved = last is None or not last.loading or (sample.bytes_processed, sample.tuples_processed) != (
+                    last.bytes_processed, last.tuples_processed)
+                if moved:
+                    moved_at = now
+                    stalled = False
+                elif not stalled and now - moved_at >= self.stall_seconds:
+                    stalled = True
+                    self.record.stalls.append({"at": sample.elapsed, "bound_by": sample.bound_by,
+                                               "wait_event": "%s:%s" % (sample.wait_event_type, sample.wait_event),
+                                               "blocked_by": sample.blocked_by})
+                    logger.warning("The COPY of backend %d has stalled for %.0fs, waiting on %s:%s%s." % (
+                        self.record.pid, now - moved_at, sample.wait_event_type, sample.wait_event,
+                        " (blocked by pid %s)" % ", ".join([str(p) for p in sample.blocked_by])
+                        if any(sample.blocked_by or []) else ""))
+                if self.log_progress and sample.copying:
+                    self.log(sample, last)
+            last = sample
+            if self.__stop.wait(self.interval):
+                break
+
+    def log(self, sample, last):
+        # type: (CopySample, Optional[CopySample])->None
+        rate = ""
+        if last is not None and last.copying and sample.elapsed > last.elapsed:
+            rate = ", %.0f tuples/s" % (((sample.tuples_processed or 0) - (last.tuples_processed or 0))
+                                       / (sample.elapsed - last.elapsed))
+        total = " of %.1f" % (sample.bytes_total / (1024.0 * 1024.0)) if sample.bytes_total else ""
+        state = "waiting on %s:%s" % (sample.wait_event_type, sample.wait_event) if sample.wait_event else "running"
+        logger.info("COPY into %s: %.1f%s MB, %d tuples%s, %s" % (
+            self.record.relation or sample.relation, (sample.bytes_processed or 0) / (1024.0 * 1024.0), total,
+            sample.tuples_processed or 0, rate, state))
+
+
+def find_copy_backend(server, credential, timeout=60.0, interval=DEFAULT_INTERVAL):
+    # type: (Server, PGPassEntry, float, float)->Optional[int]
+    """
+    the pid of a backend running COPY FROM, or waiting for the lock to start one, waiting up to `timeout`
+    seconds for one to start.
+    """
+    connection = connect(server, credential, application_name="psql_utils_copy_monitor")
+    connection.autocommit = True
+    deadline = time.perf_counter() + timeout
+    try:
+        with connection.cursor() as cursor:
+            while True:
+                cursor.execute(FIND_QUERY)
+                row = cursor.fetchone()
+                if row is not None:
+                    return row[0]
+                if time.perf_counter() >= deadline:
+                    return None
+                time.sleep(interval)
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    from copy_table import server_and_credential
+
+    parser = argparse.ArgumentParser(description="Watch a running COPY FROM on a server until its session ends.")
+    parser.add_argument("server", help="name in servers.json.")
+    parser.add_argument("--pid", type=int, default=None,
+                        help="the loading backend; default: the first COPY FROM found.")
+    parser.add_argument("--wait", type=float, default=60.0, help="seconds to wait for a COPY to start.")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="seconds between polls.")
+    parser.add_argument("--stall", type=float, default=DEFAULT_STALL_SECONDS,
+                        help="seconds without progress before a stall is reported.")
+    parser.add_argument("--record", default=None, help="append the performance record to this json lines file.")
+    parser.add_argument("--samples", action="store_true", help="include every poll in the record.")
+    arguments = parser.parse_args()
+
+    server, credential = server_and_credential(arguments.server)
+    pid = arguments.pid or find_copy_backend(server, credential, timeout=arguments.wait, interval=arguments.interval)
+    if pid is None:
+        raise SystemExit("No COPY FROM started on '%s' within %.0fs." % (arguments.server, arguments.wait))
+    monitor = CopyMonitor(server, credential, pid, interval=arguments.interval, stall_seconds=arguments.stall)
+    try:
+        # until the backend disconnects.
+        monitor.run()
+    except KeyboardInterrupt:
+        pass
+    record = monitor.record
+    print(record.to_line())
+    if arguments.record:
+        record.save(arguments.record, include_samples=arguments.samples)
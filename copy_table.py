@@ -0,0 +1,250 @@
+import queue
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, Any
+
+from core import Server, PGPassEntry, Manager, PGPassFile, connect, logger
+from progress import Progress, metrics_file_from_environment
+from export import open_snapshot_connections, block_ranges, range_copy_statement, quote_table, CountingWriter
+
+DEFAULT_JOBS = 1
+# chunks of COPY data held between the two connections of a range, per range.
+DEFAULT_BUFFER_CHUNKS = 1024
+
+
+class PipeClosed(Exception):
+    pass
+
+
+class Pipe(object):
+    """
+    a bounded queue of COPY data between a `copy_expert` writing it (from the source) and one reading it
+    (into the target). the writer blocks while the queue is full, so at most `max_chunks` chunks are in memory.
+    either side can fail: the other one then gets an exception instead of blocking forever or, worse, seeing
+    a clean end of the data and committing what it got so far.
+    """
+    def __init__(self, max_chunks=DEFAULT_BUFFER_CHUNKS):
+        # type: (int)->None
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.pending = b""
+        self.error = None  # type: Optional[Exception]
+        self.finished = False
+
+    def write(self, data):
+        # type: (bytes)->int
+        while True:
+            if self.error is not None:
+                raise PipeClosed("The target stopped reading: %s" % self.error)
+            try:
+                self.chunks.put(bytes(data), timeout=0.1)
+                return len(data)
+            except queue.Full:
+                continue
+
+    def close(self, error=None):
+        # type: (Optional[Exception])->None
+        """ ends the data. with `error`, the reading side fails instead of seeing the end. """
+        while self.error is None:
+            try:
+                self.chunks.put(error if error is not None else b"", timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def abort(self, error):
+        # type: (Exception)->None
+        """ called by the reading side when it failed, so the writing side stops. """
+        self.error = error
+
+    def read(self, size=-1):
+        # type: (int)->bytes
+        while not self.finished and (size < 0 or len(self.pending) < size):
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                raise PipeClosed("The source stopped writing: %s" % chunk)
+            if chunk == b"":
+                self.finished = True
+            self.pending += chunk
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+def table_definition(cursor, schema, table):
+    # type: (Any, str, str)->Tuple[List[str], List[str], List[Tuple[str, str]]]
+    """
+    the columns of a table as (names, column definitions, [(name, definition)] of its constraints).
+    generated columns are left out: they can't be copied, only recomputed. only the primary key and unique
+    constraints are returned, so their indexes can be built after the rows are in.
+    """
+    qualified = quote_table(schema, table)
+    cursor.execute("""
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod), a.attnotnull
+        FROM pg_attribute a
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped AND a.attgenerated = ''
+        ORDER BY a.attnum;""", (qualified,))
+    names = list()
+    definitions = list()
+    for name, sql_type, not_null in cursor.fetchall():
+        names.append(name)
+        definitions.append('"%s" %s %s' % (name.replace('"', '""'), sql_type, "NOT NULL" if not_null else "NULL"))
+    cursor.execute("""
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('p', 'u')
+        ORDER BY contype, conname;""", (qualified,))
+    return names, definitions, cursor.fetchall()
+
+
+def rollback(connection):
+    # type: (Any)->None
+    """ rolls back whatever the connection has open; a connection that is already broken is left as it is. """
+    try:
+        connection.rollback()
+    except Exception as e:
+        logger.warning("Rollback failed: %s" % e)
+
+
+def copy_table(source, source_credential, target, target_credential, schema, table, target_schema=None,
+               target_table=None, jobs=DEFAULT_JOBS, buffer_chunks=DEFAULT_BUFFER_CHUNKS, format="binary"):
+    # type: (Server, PGPassEntry, Server, PGPassEntry, str, str, Optional[str], Optional[str], int, int, str)->int
+    """
+    re-creates `schema.table` of `source` on `target` and streams its rows straight across, with no file
+    in between: each range of the source's heap is read with COPY TO STDOUT on one connection and written
+    with COPY FROM STDIN on another, through a `Pipe`. ranges come from one snapshot and are copied in parallel.
+    returns the number of rows copied.
+    binary COPY saves formatting and parsing values on both ends; use format="text" between servers whose
+    types differ in their binary representation.
+    """
+    target_schema = target_schema or schema
+    target_table = target_table or table
+    qualified_target = quote_table(target_schema, target_table)
+
+    sources = open_snapshot_connections(source, source_credential, max(1, jobs), application_name="psql_utils_copy_table")
+    targets = list()
+    try:
+        with sources[0].cursor() as cursor:
+            columns, definitions, constraints = table_definition(cursor, schema, table)
+            ranges = block_ranges(cursor, schema, table, jobs)
+        for connection in sources[len(ranges):]:
+            connection.close()
+        sources = sources[:len(ranges)]
+
+        ddl = connect(target, target_credential, application_name="psql_utils_copy_table")
+        targets.append(ddl)
+        with ddl.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS %s;" % qualified_target)
+            cursor.execute("CREATE TABLE %s (%s);" % (qualified_target, ", ".join(definitions)))
+        ddl.commit()
+        targets += [connect(target, target_credential, application_name="psql_utils_copy_table")
+                    for _ in range(len(ranges) - 1)]
+
+        progress = Progress("Copying %s.%s" % (schema, table), metrics_file=metrics_file_from_environment())
+        lock = threading.Lock()
+        copied = [0] * len(ranges)
+        copy_in = "COPY {table} ({columns}) FROM STDIN WITH (FORMAT {format});".format(
+            table=qualified_target, columns=", ".join(['"%s"' % c.replace('"', '""') for c in columns]), format=format)
+
+        def read_range(n, pipe):
+            # type: (int, Pipe)->None
+            start, end = ranges[n]
+            try:
+                with sources[n].cursor() as cursor:
+                    writer = CountingWriter(pipe, progress, lock)
+                    cursor.copy_expert(range_copy_statement(schema, table, start, end, format=format, columns=columns),
+                                       writer)
+                    writer.report()
+            except Exception as e:
+                pipe.close(error=e)
+                raise
+            pipe.close()
+
+        def write_range(n, pipe):
+            # type: (int, Pipe)->None
+            try:
+                with targets[n].cursor() as cursor:
+                    cursor.copy_expert(copy_in, pipe)
+                    copied[n] = cursor.rowcount
+                targets[n].commit()
+            except Exception as e:
+                pipe.abort(e)
+                # an aborted transaction would keep its lock on the table and block the cleanup's DROP.
+                rollback(targets[n])
+                raise
+
+        logger.info("Copying %s.%s from '%s' to %s on '%s' in %d range(s)..." % (
+            schema, table, source.name, qualified_target, target.name, len(ranges)))
+        pipes = [Pipe(buffer_chunks) for _ in ranges]
+        with ThreadPoolExecutor(max_workers=2 * len(ranges)) as executor:
+            futures = [executor.submit(read_range, n, pipes[n]) for n in range(len(ranges))]
+            futures += [executor.submit(write_range, n, pipes[n]) for n in range(len(ranges))]
+            errors = list()
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(e)
+        if any(errors):
+            # the ranges commit separately, so a failed copy would leave some of them behind. the DROP runs on
+            # a connection of its own: the failed ones may be broken, and none of them may hold a lock.
+            for connection in targets:
+                rollback(connection)
+            cleanup = connect(target, target_credential, application_name="psql_utils_copy_table")
+            try:
+                cleanup.autocommit = True
+                with cleanup.cursor() as cursor:
+                    cursor.execute("DROP TABLE IF EXISTS %s;" % qualified_target)
+            except Exception as e:
+                logger.error("Couldn't drop the partly copied %s: %s" % (qualified_target, e))
+            finally:
+                cleanup.close()
+            raise errors[0]
+        progress.finish()
+
+        with ddl.cursor() as cursor:
+            for name, definition in constraints:
+                # a copy under another name would clash with the original's index names.
+                if (target_schema, target_table) == (schema, table):
+                    definition = 'CONSTRAINT "%s" %s' % (name.replace('"', '""'), definition)
+                cursor.execute("ALTER TABLE %s ADD %s;" % (qualified_target, definition))
+            cursor.execute("ANALYZE %s;" % qualified_target)
+        ddl.commit()
+    finally:
+        for connection in sources + targets:
+            connection.close()
+    return sum(copied)
+
+
+def server_and_credential(name):
+    # type: (str)->Tuple[Server, PGPassEntry]
+    server = Manager.Servers()[name]
+    credentials = PGPassFile().filter(server=server)
+    if not any(credentials):
+        raise KeyError("No credential found for server '%s'" % name)
+    return server, credentials[0]
+
+
+def split_table_name(qualified):
+    # type: (str)->Tuple[str, str]
+    schema, table = qualified.split(".", 1) if "." in qualified else ("public", qualified)
+    return schema, table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Copy a table from one configured server to another.")
+    parser.add_argument("source", help="name of the source server in servers.json.")
+    parser.add_argument("target", help="name of the target server in servers.json.")
+    parser.add_argument("table", help="schema.table on the source.")
+    parser.add_argument("--as", dest="target_table", default=None, help="schema.table on the target, if different.")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="ranges of the table to copy in parallel.")
+    parser.add_argument("--text", action="store_true", help="copy as text rather than binary.")
+    arguments = parser.parse_args()
+
+    schema, table = split_table_name(arguments.table)
+    target_schema, target_table = split_table_name(arguments.target_table or arguments.table)
+    rows = copy_table(*(server_and_credential(arguments.source) + server_and_credential(arguments.target)),
+                      schema=schema, table=table, target_schema=target_schema, target_table=target_table,
+                      jobs=arguments.jobs, format="text" if arguments.text else "binary")
+    print("Copied %d rows." % rows)
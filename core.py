@@ -3,10 +3,15 @@ import os
 import shutil
 from configparser import ConfigParser
 import logging
+import psycopg2
 from typing import Dict, List, Generator, Any, Callable, Tuple, Callable
 
 logger = logging.Logger("psql_utils")
 logger.setLevel(logging.DEBUG)
+_handler = logging.StreamHandler()
+_handler.setLevel(logging.INFO)
+_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+logger.addHandler(_handler)
 
 
 class Config(object):
@@ -37,7 +42,8 @@ class Config(object):
         cls.__ensure_config_file_exists()
         config = ConfigParser()
         with open(cls.config_file, 'r', encoding='utf-8') as f:
-            return config.read_file(f)
+            config.read_file(f)
+        return config
 
     def __init__(self):
         # type: ()->None
@@ -127,6 +133,13 @@ class Server(object):
             return [cls.deserialize(d) for d in data]
 
 
+def connect(server, credential, **kwargs):
+    # type: (Server, PGPassEntry, Any)->psycopg2.extensions.connection
+    """ opens a psycopg2 connection to `server` using the database/user/password of `credential`. """
+    return psycopg2.connect(host=server.host, port=server.port, dbname=credential.db,
+                            user=credential.username, password=credential.password, **kwargs)
+
+
 class Manager(object):
     class Servers(object):
         _file = "servers.json"
@@ -161,12 +174,16 @@ class Manager(object):
 
 
 class Interface(object):
-    _servers = Manager.Servers()
-    _credentials = PGPassFile()
-    _config = Config()
+    # loaded on first use rather than at import, so scripts can import this module from any directory.
+    _servers = None  # type: Manager.Servers
+    _credentials = None  # type: PGPassFile
+    _config = None  # type: Config
 
     def __init__(self):
-        pass
+        if Interface._servers is None:
+            Interface._servers = Manager.Servers()
+            Interface._credentials = PGPassFile()
+            Interface._config = Config()
 
     def select_prompt(self, prompt, options, say_on_select=None, say_on_error="Failed to understand selection", retry=True):
         # type: (str, List[Tuple[Any, str]], str, str, bool)->Any
@@ -231,6 +248,18 @@ class Interface(object):
         credential = self.select_credential_prompt(choices=credentials)
         return server, credential
 
+    def server_credential_pairs(self):
+        # type: ()->List[Tuple[Server, PGPassEntry]]
+        """ pairs every configured server with the first matching credential. servers without one are skipped. """
+        pairs = list()
+        for server in self._servers:
+            credentials = self._credentials.filter(server=server)
+            if any(credentials):
+                pairs.append((server, credentials[0]))
+            else:
+                logger.warning("No credential found for server '%s'" % server.name)
+        return pairs
+
 
 class TaskResult(object):
     def __init__(self, success=None, error=None, cancel=None):
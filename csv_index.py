@@ -0,0 +1,232 @@
+import io
+import os
+import re
+import sys
+import csv
+import json
+import hashlib
+from array import array
+from itertools import islice
+from typing import List, Tuple, Optional, Generator, Any
+
+INDEX_VERSION = 1
+DEFAULT_STRIDE = 1000
+CHUNK_SIZE = 1 << 22
+FINGERPRINT_BYTES = 1 << 16
+
+
+def fingerprint(filepath):
+    # type: (str)->dict
+    """ size, mtime and a hash of the first and last 64KB: cheap, and changes whenever the file is rewritten or appended to. """
+    stat = os.stat(filepath)
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if stat.st_size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, stat.st_size - FINGERPRINT_BYTES))
+            digest.update(f.read(FINGERPRINT_BYTES))
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": digest.hexdigest()}
+
+
+def scan_row_offsets(f, stride=DEFAULT_STRIDE, quotechar='"', start_offset=0, start_row=0):
+    # type: (Any, int, str, int, int)->Tuple[array, int]
+    """
+    scans a binary file for the byte offset of every `stride`-th row, counting the first row as row 0.
+    a newline inside a quoted field doesn't end a row. an escaped quote ("") flips the quote state twice,
+    so it needs no special handling.
+    returns the offsets and the number of rows; no offsets at all when there are no bytes to scan.
+
+    chunks without any quote char are the common case. there every newline ends a row, so the regex
+    only has to find newlines, and islice steps over them in C.
+    """
+    quote = quotechar.encode("ascii")
+    newline = re.compile(b"\n")
+    special = re.compile(b"[" + re.escape(quote) + b"\n]")
+
+    offsets = array('q')
+    if start_row % stride == 0:
+        offsets.append(start_offset)
+    row = start_row  # index of the row that starts at the current position.
+    in_quotes = False
+    base = start_offset
+    last_byte = b"\n"
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if not in_quotes and quote not in chunk:
+            # the first newline starts row `row + 1`. pick the ones that start a multiple of `stride`.
+            first = (-(row + 1)) % stride
+            offsets.extend([base + m.end() for m in islice(newline.finditer(chunk), first, None, stride)])
+            row += chunk.count(b"\n")
+        else:
+            for m in special.finditer(chunk):
+                if m.group() == quote:
+                    in_quotes = not in_quotes
+                elif not in_quotes:
+                    row += 1
+                    if row % stride == 0:
+                        offsets.append(base + m.end())
+        base += len(chunk)
+        last_byte = chunk[-1:]
+
+    if base == start_offset:
+        # nothing to scan: no row starts at `start_offset`.
+        return array('q'), row
+    if last_byte == b"\n":
+        # the final newline doesn't start a row.
+        if len(offsets) and offsets[-1] == base and base != start_offset:
+            offsets.pop()
+    else:
+        row += 1
+    return offsets, row
+
+
+class ByteRange(object):
+    """ a read-only view of `length` bytes of an open binary file, starting at its current position. """
+    def __init__(self, f, length):
+        # type: (Any, int)->None
+        self.f = f
+        self.remaining = length
+
+    def read(self, n=-1):
+        # type: (int)->bytes
+        if n < 0 or n > self.remaining:
+            n = self.remaining
+        data = self.f.read(n)
+        self.remaining -= len(data)
+        return data
+
+
+def count_rows(filepath, start, end, quotechar='"'):
+    # type: (str, int, int, str)->int
+    """ the number of rows between two row-aligned byte offsets. """
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        offsets, rows = scan_row_offsets(ByteRange(f, end - start), stride=1 << 62, quotechar=quotechar,
+                                         start_offset=start)
+    return rows
+
+
+def header_end(filepath, quotechar='"'):
+    # type: (str, str)->int
+    """ the offset of the first row after the header. """
+    with open(filepath, 'rb') as f:
+        offsets, rows = scan_row_offsets(ByteRange(f, CHUNK_SIZE), stride=1, quotechar=quotechar)
+    if len(offsets) > 1:
+        return offsets[1]
+    return os.path.getsize(filepath)
+
+
+def last_row_end(filepath):
+    # type: (str)->int
+    """
+    the offset just past the last newline. a final line without one may still be being written, so it is
+    left for the next load. (this assumes that partial line isn't inside a quoted field with a newline in it.)
+    """
+    size = os.path.getsize(filepath)
+    with open(filepath, 'rb') as f:
+        end = size
+        while end > 0:
+            start = max(0, end - CHUNK_SIZE)
+            f.seek(start)
+            position = f.read(end - start).rfind(b"\n")
+            if position >= 0:
+                return start + position + 1
+            end = start
+    return 0
+
+
+class RowIndex(object):
+    """
+    the byte offset of every `stride`-th row of a CSV file, saved next to it as `<file>.idx`.
+    the sidecar is reused until the file's fingerprint changes.
+    """
+    def __init__(self, filepath, stride, offsets, row_count, file_fingerprint):
+        # type: (str, int, array, int, dict)->None
+        self.filepath = filepath
+        self.stride = stride
+        self.offsets = offsets
+        self.row_count = row_count
+        self.fingerprint = file_fingerprint
+
+    @staticmethod
+    def sidecar_path(filepath):
+        # type: (str)->str
+        return filepath + ".idx"
+
+    @classmethod
+    def build(cls, filepath, stride=DEFAULT_STRIDE, quotechar='"'):
+        # type: (str, int, str)->RowIndex
+        file_fingerprint = fingerprint(filepath)
+        with open(filepath, 'rb') as f:
+            offsets, row_count = scan_row_offsets(f, stride=stride, quotechar=quotechar)
+        return cls(filepath, stride, offsets, row_count, file_fingerprint)
+
+    @classmethod
+    def load(cls, filepath):
+        # type: (str)->Optional[RowIndex]
+        """ returns the saved index, or None if there is none or it is stale. """
+        index_path = cls.sidecar_path(filepath)
+        if not os.path.isfile(index_path):
+            return None
+        with open(index_path, 'rb') as f:
+            header = json.loads(f.readline().decode("utf8"))
+            if header.get("version") != INDEX_VERSION or header.get("fingerprint") != fingerprint(filepath):
+                return None
+            offsets = array('q')
+            offsets.frombytes(f.read())
+        if header["byteorder"] != sys.byteorder:
+            offsets.byteswap()
+        return cls(filepath, header["stride"], offsets, header["row_count"], header["fingerprint"])
+
+    def save(self):
+        header = {
+            "version": INDEX_VERSION,
+            "stride": self.stride,
+            "row_count": self.row_count,
+            "fingerprint": self.fingerprint,
+            "byteorder": sys.byteorder,
+        }
+        with open(self.sidecar_path(self.filepath), 'wb') as f:
+            f.write(json.dumps(header).encode("utf8") + b"\n")
+            self.offsets.tofile(f)
+
+    @classmethod
+    def for_file(cls, filepath, stride=DEFAULT_STRIDE, quotechar='"'):
+        # type: (str, int, str)->RowIndex
+        index = cls.load(filepath)
+        if index is None or index.stride != stride:
+            index = cls.build(filepath, stride=stride, quotechar=quotechar)
+            index.save()
+        return index
+
+    def locate(self, row):
+        # type: (int)->Tuple[int, int]
+        """ returns (offset of the nearest indexed row at or before `row`, number of rows to skip from there). """
+        if row < 0 or row >= self.row_count:
+            raise IndexError(row)
+        slot = row // self.stride
+        return self.offsets[slot], row - slot * self.stride
+
+    def chunks(self, num_chunks):
+        # type: (int)->List[Tuple[int, int]]
+        """ splits the file into up to `num_chunks` (start, end) byte ranges that begin and end on row boundaries. """
+        size = self.fingerprint["size"]
+        if not len(self.offsets):
+            return []
+        num_chunks = max(1, min(num_chunks, len(self.offsets)))
+        starts = [self.offsets[(i * len(self.offsets)) // num_chunks] for i in range(num_chunks)]
+        ends = starts[1:] + [size]
+        return [(start, end) for start, end in zip(starts, ends) if end > start]
+
+    def read_rows(self, start_row, count, encoding="utf8", **reader_kwargs):
+        # type: (int, int, str, Any)->Generator[List[str]]
+        """ yields `count` parsed rows starting at `start_row`, reading only from the nearest indexed offset. """
+        offset, skip = self.locate(start_row)
+        with open(self.filepath, 'rb') as raw:
+            raw.seek(offset)
+            f = io.TextIOWrapper(raw, encoding=encoding, newline="")
+            reader = csv.reader(f, **reader_kwargs)
+            for row in islice(reader, skip, skip + count):
+                yield row
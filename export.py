@@ -0,0 +1,198 @@
+import os
+import bz2
+import gzip
+import lzma
+import shutil
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, Any
+
+from core import Server, PGPassEntry, Manager, PGPassFile, connect, logger
+from progress import Progress, metrics_file_from_environment
+
+DEFAULT_JOBS = 4
+# below this many blocks per worker, the extra connections cost more than they save.
+MIN_BLOCKS_PER_RANGE = 128
+
+# level 1: an export is bound by disk or network, and higher levels would make it bound by the cpu instead.
+COMPRESSORS = {
+    "gzip": (".gz", lambda path: gzip.open(path, 'wb', compresslevel=1)),
+    "bz2": (".bz2", lambda path: bz2.open(path, 'wb', compresslevel=1)),
+    "xz": (".xz", lambda path: lzma.open(path, 'wb', preset=1)),
+}
+
+
+def open_snapshot_connections(server, credential, size, application_name="psql_utils_export"):
+    # type: (Server, PGPassEntry, int, str)->List[Any]
+    """
+    `size` read-only connections that all see the same exported snapshot, the way `pg_dump --jobs` does.
+    the first one holds the snapshot, so it has to stay open until the others are done.
+    """
+    connections = list()
+    try:
+        for i in range(size):
+            connection = connect(server, credential, application_name=application_name)
+            connection.set_session(isolation_level="REPEATABLE READ", readonly=True)
+            connections.append(connection)
+            with connection.cursor() as cursor:
+                if i == 0:
+                    cursor.execute("SELECT pg_export_snapshot();")
+                    snapshot = cursor.fetchone()[0]
+                else:
+                    cursor.execute("SET TRANSACTION SNAPSHOT %s;", (snapshot,))
+    except Exception:
+        for connection in connections:
+            connection.close()
+        raise
+    return connections
+
+
+def quote_table(schema, table):
+    # type: (str, str)->str
+    return '"%s"."%s"' % (schema.replace('"', '""'), table.replace('"', '""'))
+
+
+def block_ranges(cursor, schema, table, jobs):
+    # type: (Any, str, str, int)->List[Tuple[int, Optional[int]]]
+    """
+    splits the table's heap into up to `jobs` ranges of blocks, [start, end). the last range is open, so rows
+    on blocks added since the size was read aren't missed. a single open range means: don't split.
+    """
+    cursor.execute("SELECT current_setting('server_version_num')::int;")
+    if cursor.fetchone()[0] < 140000:
+        # before TID range scans, every worker would read the whole table to find its ctids.
+        logger.warning("Postgres 14 or later is needed to export in parallel; exporting over one connection.")
+        return [(0, None)]
+    cursor.execute("SELECT pg_relation_size(%s::regclass) / current_setting('block_size')::int;",
+                   (quote_table(schema, table),))
+    blocks = cursor.fetchone()[0]
+    jobs = max(1, min(jobs, blocks // MIN_BLOCKS_PER_RANGE))
+    starts = [(i * blocks) // jobs for i in range(jobs)]
+    return list(zip(starts, starts[1:] + [None]))
+
+
+def range_copy_statement(schema, table, start, end, header=False, format="csv", columns=None):
+    # type: (str, str, int, Optional[int], bool, str, Optional[List[str]])->str
+    conditions = list()
+    if start > 0:
+        conditions.append("ctid >= '(%d,0)'::tid" % start)
+    if end is not None:
+        conditions.append("ctid < '(%d,0)'::tid" % end)
+    return "COPY (SELECT {columns} FROM {table}{where}) TO STDOUT WITH (FORMAT {format}{header});".format(
+        columns="*" if columns is None else ", ".join(['"%s"' % c.replace('"', '""') for c in columns]),
+        table=quote_table(schema, table),
+        where=" WHERE " + " AND ".join(conditions) if any(conditions) else "",
+        format=format,
+        header=", HEADER" if header else "",
+    )
+
+
+class CountingWriter(object):
+    """
+    passes every write on to `f` and counts it. the counts are added to a `Progress` shared by the worker
+    threads once per `batch_rows` rows, so the lock isn't taken for every row; `report()` adds the rest.
+    """
+    batch_rows = 1024
+
+    def __init__(self, f, progress, lock):
+        # type: (Any, Progress, threading.Lock)->None
+        self.f = f
+        self.progress = progress
+        self.lock = lock
+        self.rows = 0
+        self.nbytes = 0
+
+    def write(self, data):
+        # psycopg2 writes one row per call.
+        n = self.f.write(data)
+        self.rows += 1
+        self.nbytes += len(data)
+        if self.rows >= self.batch_rows:
+            self.report()
+        return n
+
+    def report(self):
+        # type: ()->None
+        with self.lock:
+            self.progress.advance(self.nbytes)
+            self.progress.update(rows=self.rows)
+        self.rows = self.nbytes = 0
+
+
+def part_path(output, n, suffix=""):
+    # type: (str, int, str)->str
+    return "%s.part-%04d%s" % (output, n, suffix)
+
+
+def export_table(server, credential, schema, table, output, jobs=DEFAULT_JOBS, parts=False, compression=None,
+                 header=True):
+    # type: (Server, PGPassEntry, str, str, str, int, bool, Optional[str], bool)->List[str]
+    """
+    streams `schema.table` to `output` as CSV over up to `jobs` connections, each reading its own range of ctids
+    from one shared snapshot. each range goes to its own part file. unless `parts` is set, the parts are then
+    joined into `output`: a gzip, bz2 or xz stream of several members still decompresses as one file.
+    only the first part has the header. returns the paths written.
+    """
+    suffix, open_output = COMPRESSORS[compression] if compression else ("", lambda path: open(path, 'wb'))
+    base = output[:-len(suffix)] if suffix and output.endswith(suffix) else output
+    output = base + suffix
+    connections = open_snapshot_connections(server, credential, max(1, jobs))
+    try:
+        with connections[0].cursor() as cursor:
+            ranges = block_ranges(cursor, schema, table, jobs)
+        for connection in connections[len(ranges):]:
+            connection.close()
+        connections = connections[:len(ranges)]
+        paths = [part_path(base, n, suffix) for n in range(len(ranges))]
+        progress = Progress("Exporting %s.%s" % (schema, table), metrics_file=metrics_file_from_environment())
+        lock = threading.Lock()
+
+        def export_range(n):
+            # type: (int)->None
+            start, end = ranges[n]
+            with open_output(paths[n]) as f, connections[n].cursor() as cursor:
+                writer = CountingWriter(f, progress, lock)
+                cursor.copy_expert(range_copy_statement(schema, table, start, end, header=header and n == 0), writer)
+                writer.report()
+
+        logger.info("Exporting %s.%s in %d range(s)..." % (schema, table, len(ranges)))
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            for future in [executor.submit(export_range, n) for n in range(len(ranges))]:
+                future.result()
+        progress.finish()
+    finally:
+        for connection in connections:
+            connection.close()
+
+    if parts:
+        return paths
+    os.replace(paths[0], output)
+    with open(output, 'ab') as out:
+        for path in paths[1:]:
+            with open(path, 'rb') as f:
+                shutil.copyfileobj(f, out, 1 << 20)
+            os.remove(path)
+    return [output]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export a table to CSV over several connections at once.")
+    parser.add_argument("server", help="name of a server in servers.json.")
+    parser.add_argument("table", help="schema.table")
+    parser.add_argument("output")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS)
+    parser.add_argument("--parts", action="store_true", help="keep one file per range instead of joining them.")
+    parser.add_argument("--compress", choices=sorted(COMPRESSORS.keys()), default=None)
+    parser.add_argument("--no-header", action="store_true")
+    arguments = parser.parse_args()
+
+    server = Manager.Servers()[arguments.server]
+    credentials = PGPassFile().filter(server=server)
+    if not any(credentials):
+        raise KeyError("No credential found for server '%s'" % arguments.server)
+    schema, table = arguments.table.split(".", 1) if "." in arguments.table else ("public", arguments.table)
+    for path in export_table(server, credentials[0], schema, table, os.path.abspath(arguments.output),
+                             jobs=arguments.jobs, parts=arguments.parts, compression=arguments.compress,
+                             header=not arguments.no_header):
+        print(path)
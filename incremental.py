@@ -0,0 +1,133 @@
+import os
+import json
+import hashlib
+from typing import List, Dict, Optional, Tuple
+
+STATE_VERSION = 1
+DIGEST_BYTES = 1 << 16
+
+# within a chain, each type can hold every value of the types before it, so a column only ever moves right.
+# a column that has to leave its chain becomes TEXT, which holds anything.
+WIDENING_CHAINS = [["INTEGER", "BIGINT", "NUMERIC", "TEXT"], ["DATE", "TIMESTAMP", "TEXT"]]
+
+
+def prefix_digest(filepath, start, end):
+    # type: (str, int, int)->str
+    """ a hash of the length and the first and last 64KB of the bytes in [start, end). """
+    digest = hashlib.sha1(str(end - start).encode("ascii"))
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        digest.update(f.read(min(DIGEST_BYTES, end - start)))
+        if end - start > DIGEST_BYTES:
+            f.seek(max(start + DIGEST_BYTES, end - DIGEST_BYTES))
+            digest.update(f.read(end - f.tell()))
+    return digest.hexdigest()
+
+
+def widen(old_type, new_type):
+    # type: (str, str)->str
+    for chain in WIDENING_CHAINS:
+        if old_type in chain and new_type in chain:
+            return chain[max(chain.index(old_type), chain.index(new_type))]
+    return "TEXT"
+
+
+class LoadState(object):
+    """
+    what an append-only file's last load covered, saved next to the file as `<file>.load.json`.
+    the generated SQL writes it as `<file>.load.json.pending` and only moves it into place once the load commits.
+    """
+    def __init__(self, header, data_start, offset, row_count, digest, columns):
+        # type: (List[str], int, int, int, str, List[Dict])->None
+        self.header = header
+        self.data_start = data_start  # offset of the first row after the header.
+        self.offset = offset  # everything before this offset has been loaded.
+        self.row_count = row_count
+        self.digest = digest  # prefix_digest() of [data_start, offset).
+        self.columns = columns  # [{"name": ..., "type": ..., "nullable": ...}] as the table was last left.
+
+    @staticmethod
+    def sidecar_path(filepath):
+        # type: (str)->str
+        return filepath + ".load.json"
+
+    @classmethod
+    def pending_path(cls, filepath):
+        # type: (str)->str
+        return cls.sidecar_path(filepath) + ".pending"
+
+    @classmethod
+    def load(cls, filepath):
+        # type: (str)->Optional[LoadState]
+        state_path = cls.sidecar_path(filepath)
+        if not os.path.isfile(state_path):
+            return None
+        with open(state_path, 'r', encoding='utf8') as f:
+            data = json.load(f)
+        if data.get("version") != STATE_VERSION:
+            return None
+        return cls(data["header"], data["data_start"], data["offset"], data["row_count"], data["digest"], data["columns"])
+
+    def save(self, state_path):
+        # type: (str)->None
+        with open(state_path, 'w', encoding='utf8') as f:
+            json.dump({
+                "version": STATE_VERSION,
+                "header": self.header,
+                "data_start": self.data_start,
+                "offset": self.offset,
+                "row_count": self.row_count,
+                "digest": self.digest,
+                "columns": self.columns,
+            }, f, indent=1)
+
+    def is_prefix_of(self, filepath, data_start):
+        # type: (str, int)->bool
+        """ true if the rows loaded last time are still the start of the file's data, unchanged. """
+        if os.path.getsize(filepath) < data_start + (self.offset - self.data_start):
+            return False
+        # a header that only gained columns moves the data, but doesn't change it.
+        return prefix_digest(filepath, data_start, data_start + self.offset - self.data_start) == self.digest
+
+
+class Evolution(object):
+    """ the changes that bring the table from a previous load's shape up to the columns of the new rows. """
+    def __init__(self):
+        self.added = list()  # type: List[Dict]
+        self.widened = list()  # type: List[Tuple[str, str, str]]
+        self.relaxed = list()  # type: List[str]
+        self.columns = list()  # type: List[Dict]
+
+    @property
+    def changed(self):
+        return any(self.added) or any(self.widened) or any(self.relaxed)
+
+
+def plan_evolution(previous_columns, inferred_columns):
+    # type: (List[Dict], List[Dict])->Optional[Evolution]
+    """
+    compares the columns of the last load with the ones inferred from the new rows.
+    returns None if the new columns don't start with the old ones, in which case only a full reload is safe.
+    """
+    previous_names = [c["name"] for c in previous_columns]
+    inferred_names = [c["name"] for c in inferred_columns]
+    if inferred_names[:len(previous_names)] != previous_names:
+        return None
+
+    evolution = Evolution()
+    for previous, inferred in zip(previous_columns, inferred_columns):
+        column = dict(previous)
+        wider = widen(previous["type"], inferred["type"])
+        if wider != previous["type"]:
+            evolution.widened.append((previous["name"], previous["type"], wider))
+            column["type"] = wider
+        if inferred["nullable"] and not previous["nullable"]:
+            evolution.relaxed.append(previous["name"])
+            column["nullable"] = True
+        evolution.columns.append(column)
+    for inferred in inferred_columns[len(previous_columns):]:
+        # the rows loaded before this column existed have no value for it.
+        column = dict(inferred, nullable=True)
+        evolution.added.append(column)
+        evolution.columns.append(column)
+    return evolution
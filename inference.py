@@ -0,0 +1,294 @@
+import re
+import math
+import datetime
+from collections import Counter
+from itertools import zip_longest
+from typing import List, Iterable, Optional, Dict, Any, Callable
+
+class BigInt(int):
+    """ stands for integers that need postgres BIGINT: values are still parsed as plain ints. """
+
+
+# candidate python types, strictest first. a column gets the strictest type that every value allows.
+TYPES = [int, BigInt, float, datetime.date, datetime.datetime, str]
+_ALL_TYPES = (1 << len(TYPES)) - 1
+
+
+def _mask(types):
+    # type: (Iterable[type])->int
+    mask = 0
+    for _type in types:
+        mask |= 1 << TYPES.index(_type)
+    return mask
+
+
+class Rule(object):
+    """
+    a value that fully matches `pattern` is compatible with `types` only. `check` confirms what a pattern can't
+    express; a value that matches but fails it falls through to the next rule that takes it, or else is TEXT.
+    """
+    def __init__(self, name, pattern, types, check=None):
+        # type: (str, str, List[type], Optional[Callable[[str], bool]])->None
+        self.name = name
+        self.pattern = pattern
+        self.types = types
+        self.check = check
+        self.mask = _mask(types)
+
+
+def _valid_date(value):
+    # type: (str)->bool
+    """ whether the date at the start of an ISO 8601 value exists: the pattern lets 2021-02-31 through. """
+    try:
+        datetime.date(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+        return True
+    except ValueError:
+        return False
+
+
+def _fits_int4(value):
+    # type: (str)->bool
+    """ whether an integer fits postgres INTEGER. up to 9 characters always do. """
+    return len(value) < 10 or -2147483648 <= int(value) <= 2147483647
+
+
+def _fits_int8(value):
+    # type: (str)->bool
+    return len(value) < 19 or -9223372036854775808 <= int(value) <= 9223372036854775807
+
+
+INTEGER_PATTERN = r"[-+]?(?:0|[1-9][0-9]*)"
+
+# order matters: the first rule whose pattern matches the whole value, and whose check passes, wins.
+DEFAULT_RULES = [
+    Rule("INTEGER", INTEGER_PATTERN, [int, BigInt, float, str], check=_fits_int4),
+    Rule("BIGINT", INTEGER_PATTERN, [BigInt, float, str], check=_fits_int8),
+    # any more digits only fit NUMERIC.
+    Rule("LARGE_INTEGER", INTEGER_PATTERN, [float, str]),
+    # zero-padded codes lose their padding as numbers.
+    Rule("LEADING_ZERO", r"[-+]?0[0-9]+", [str]),
+    Rule("DECIMAL", r"[-+]?(?:[0-9]+\.[0-9]*|\.[0-9]+)", [float, str]),
+    # ISO 8601 only: other layouts are ambiguous, and postgres would read them according to DateStyle.
+    Rule("DATE", r"[0-9]{4}-(?:0[1-9]|1[0-2])-(?:0[1-9]|[12][0-9]|3[01])", [datetime.date, datetime.datetime, str],
+         check=_valid_date),
+    Rule("TIMESTAMP", r"[0-9]{4}-(?:0[1-9]|1[0-2])-(?:0[1-9]|[12][0-9]|3[01])[ T](?:[01][0-9]|2[0-3]):[0-5][0-9]"
+                      r"(?::[0-5][0-9](?:\.[0-9]{1,6})?)?",
+         [datetime.datetime, str], check=_valid_date),
+    # postgres COPY rejects an empty string for any type but TEXT, unless it is the NULL string.
+    Rule("EMPTY", r"", [str]),
+]
+
+# matches the `NULL AS '\N'` of the generated COPY statements.
+DEFAULT_NULL_VALUES = ["\\N"]
+
+NULL = "NULL"
+TEXT = "TEXT"
+
+# sampling stops once every column's verdict has held for long enough to say, with CONFIDENCE, that fewer
+# than TOLERANCE of the rows would change it, or else after MAX_SAMPLE_ROWS rows.
+CONFIDENCE = 0.95
+TOLERANCE = 0.001
+MAX_SAMPLE_ROWS = 100000
+
+
+class RuleSet(object):
+    """
+    compiles the rules into one alternation, so classifying a value is a single `fullmatch` in C.
+    the classification of each distinct value is cached, so repeated values cost one dict lookup.
+    """
+    def __init__(self, rules=None, null_values=None):
+        # type: (List[Rule], List[str])->None
+        self.rules = list(DEFAULT_RULES if rules is None else rules)
+        self.null_values = list(DEFAULT_NULL_VALUES if null_values is None else null_values)
+        alternatives = ["(?P<%s>%s)" % (NULL, "|".join([re.escape(v) for v in self.null_values]))] if any(self.null_values) else []
+        alternatives += ["(?P<%s>%s)" % (rule.name, rule.pattern) for rule in self.rules]
+        self.__fullmatch = re.compile("|".join(alternatives)).fullmatch
+        self.masks = {rule.name: rule.mask for rule in self.rules}
+        self.checks = {rule.name: rule.check for rule in self.rules if rule.check is not None}
+        # each rule on its own, for values that fail the check of the rule the alternation picked.
+        self.__rule_matches = [(rule.name, re.compile(rule.pattern).fullmatch, rule.check) for rule in self.rules]
+        self.masks[NULL] = _ALL_TYPES
+        self.masks[TEXT] = _mask([str])
+        self.__cache = dict()  # type: Dict[str, str]
+
+    def classify(self, value):
+        # type: (str)->str
+        """ returns the name of the rule `value` falls under: a rule name, NULL, or TEXT if nothing matched. """
+        name = self.__cache.get(value)
+        if name is None:
+            match = self.__fullmatch(value)
+            name = TEXT if match is None else match.lastgroup
+            check = self.checks.get(name)
+            if check is not None and not check(value):
+                name = self.__fall_through(name, value)
+            if len(self.__cache) < 100000:
+                self.__cache[value] = name
+        return name
+
+    def __fall_through(self, failed, value):
+        # type: (str, str)->str
+        """ the first rule after `failed` that takes `value`, or TEXT. """
+        names = [name for name, _, _ in self.__rule_matches]
+        for name, fullmatch, check in self.__rule_matches[names.index(failed) + 1:]:
+            if fullmatch(value) is not None and (check is None or check(value)):
+                return name
+        return TEXT
+
+
+class ColumnInference(object):
+    """ the running type/nullability verdict for one column. """
+    def __init__(self, rules=None):
+        # type: (Optional[RuleSet])->None
+        self.rules = rules or default_rules
+        self.mask = _ALL_TYPES
+        self.nullable = False
+        self.events = Counter()  # rule name -> number of values classified under it.
+
+    def add(self, value):
+        # type: (str)->None
+        name = self.rules.classify(value)
+        self.events[name] += 1
+        self.mask &= self.rules.masks[name]
+        if name == NULL:
+            self.nullable = True
+
+    def add_many(self, values):
+        # type: (Iterable[str])->None
+        """ classifies each distinct value once; `Counter` does the per-value work in C. """
+        self.add_counts(Counter(values))
+
+    def add_counts(self, value_counts):
+        # type: (Dict[str, int])->None
+        classify = self.rules.classify
+        masks = self.rules.masks
+        for value, n in value_counts.items():
+            name = classify(value)
+            self.events[name] += n
+            self.mask &= masks[name]
+        if self.events[NULL] > 0:
+            self.nullable = True
+
+    @property
+    def possible_types(self):
+        # type: ()->List[type]
+        return [_type for idx, _type in enumerate(TYPES) if self.mask & (1 << idx)]
+
+    @property
+    def determined(self):
+        # type: ()->bool
+        """ true once only `str` is left, which no further value can change. """
+        return self.mask == _mask([str])
+
+    @property
+    def python_type(self):
+        # type: ()->type
+        possible = self.possible_types
+        # every rule allows str, so this can only be empty if a custom rule allows nothing.
+        if not any(possible):
+            return str
+        return possible[0]
+
+
+default_rules = RuleSet()
+
+
+def infer_column(values, rules=None):
+    # type: (Iterable[str], Optional[RuleSet])->ColumnInference
+    inference = ColumnInference(rules)
+    inference.add_many(values)
+    return inference
+
+
+def infer_columns(rows, num_columns, rules=None):
+    # type: (List[List[str]], int, Optional[RuleSet])->List[ColumnInference]
+    """ infers every column of `rows`. short rows are treated as missing values, not nulls. """
+    inferences = [ColumnInference(rules) for _ in range(num_columns)]
+    # transposing and counting both happen in C.
+    for inference, column in zip(inferences, zip_longest(*rows)):
+        counts = Counter(column)
+        counts.pop(None, None)
+        inference.add_counts(counts)
+    return inferences
+
+
+def parse_value(python_type, value):
+    # type: (type, str)->Any
+    """ the python value of a string inferred as `python_type`, or None for nulls and values that don't parse. """
+    try:
+        if python_type in (int, BigInt):
+            return int(value)
+        elif python_type == float:
+            return float(value)
+        elif python_type == datetime.date:
+            return datetime.date.fromisoformat(value)
+        elif python_type == datetime.datetime:
+            return datetime.datetime.fromisoformat(value)
+        elif python_type == str:
+            return value
+    except ValueError:
+        return None
+
+
+def stable_rows_needed(confidence=CONFIDENCE, tolerance=TOLERANCE):
+    # type: (float, float)->int
+    """
+    if each row changed the verdict with probability `tolerance`, a run of n rows without a change would
+    happen with probability (1 - tolerance)^n. that's below 1 - `confidence` once n >= ln(1 - confidence) / ln(1 - tolerance),
+    about 3 / tolerance rows for 95%.
+    """
+    return int(math.ceil(math.log(1.0 - confidence) / math.log(1.0 - tolerance)))
+
+
+class SampleConvergence(object):
+    """
+    follows the type and nullability of every column while a sample is read in batches. a column has converged
+    once its verdict hasn't changed for `stable_rows_needed` rows; only the columns that haven't are still
+    inferred, and the sample can stop as soon as none are left.
+    """
+    def __init__(self, num_columns, rules=None, confidence=CONFIDENCE, tolerance=TOLERANCE):
+        # type: (int, Optional[RuleSet], float, float)->None
+        self.inferences = [ColumnInference(rules) for _ in range(num_columns)]
+        self.rows_needed = stable_rows_needed(confidence, tolerance)
+        self.rows = 0
+        # the number of rows read when each column's verdict last changed.
+        self.changed_at = [0] * num_columns
+
+    def converged(self, idx):
+        # type: (int)->bool
+        return self.rows > 0 and self.rows - self.changed_at[idx] >= self.rows_needed
+
+    @property
+    def uncertain(self):
+        # type: ()->List[int]
+        return [idx for idx in range(len(self.inferences)) if not self.converged(idx)]
+
+    @property
+    def done(self):
+        # type: ()->bool
+        return not any(self.uncertain)
+
+    def add(self, num_rows, counts_of):
+        # type: (int, Callable[[int], Dict[str, int]])->bool
+        """
+        adds a batch of `num_rows` rows. `counts_of(idx)` returns the value counts of column `idx` in the batch,
+        and is only called for columns that haven't converged. returns whether every column has converged.
+        """
+        for idx in self.uncertain:
+            inference = self.inferences[idx]
+            verdict = (inference.mask, inference.nullable)
+            inference.add_counts(counts_of(idx))
+            if (inference.mask, inference.nullable) != verdict:
+                # somewhere in this batch: only rows after it count as stable.
+                self.changed_at[idx] = self.rows + num_rows
+        self.rows += num_rows
+        return self.done
+
+    def add_rows(self, rows):
+        # type: (List[List[str]])->bool
+        columns = list(zip_longest(*rows))
+
+        def counts_of(idx):
+            counts = Counter(columns[idx]) if idx < len(columns) else Counter()
+            counts.pop(None, None)
+            return counts
+        return self.add(len(rows), counts_of)
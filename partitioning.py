@@ -0,0 +1,142 @@
+import math
+import datetime
+from typing import List, Optional, Any, Tuple
+
+from inference import parse_value, BigInt
+
+DEFAULT_PARTITION_ROWS = 10000000
+MAX_PARTITIONS = 1000
+
+# calendar units for date/timestamp partitions, finest first, with their average length in days.
+DATE_UNITS = [("day", 1.0), ("month", 30.44), ("year", 365.25)]
+
+
+class Partition(object):
+    def __init__(self, suffix, lower, upper):
+        # type: (str, str, str)->None
+        self.suffix = suffix
+        self.lower = lower  # sql literal, inclusive.
+        self.upper = upper  # sql literal, exclusive.
+
+
+class PartitionPlan(object):
+    """ range partitions over one column. rows outside every range, or with a null key, go to a default partition. """
+    def __init__(self, column, kind, partitions, estimated_rows):
+        # type: (str, str, List[Partition], int)->None
+        self.column = column
+        self.kind = kind
+        self.partitions = partitions
+        self.estimated_rows = estimated_rows
+
+
+def is_monotonic(values):
+    # type: (List[Any])->bool
+    return all(a <= b for a, b in zip(values, values[1:]))
+
+
+def _nice(n):
+    # type: (float)->int
+    """ rounds up to 1, 2 or 5 times a power of ten, so integer bounds are readable. """
+    if n <= 1:
+        return 1
+    magnitude = 10 ** int(math.floor(math.log10(n)))
+    for step in (1, 2, 5, 10):
+        if step * magnitude >= n:
+            return step * magnitude
+
+
+def plan_integer_partitions(column, values, estimated_rows, target_rows):
+    # type: (str, List[int], int, int)->Optional[PartitionPlan]
+    """
+    `values` are the column's sampled values in file order, followed by the values seen at the end of the file.
+    only a column that never decreases is a good key: the sample then bounds its range.
+    """
+    if len(values) < 2 or not is_monotonic(values):
+        return None
+    low, high = values[0], values[-1]
+    span = high - low + 1
+    rows_per_unit = float(estimated_rows) / span
+    width = max(_nice(target_rows / rows_per_unit), _nice(float(span) / MAX_PARTITIONS))
+    start = (low // width) * width
+    partitions = list()
+    lower = start
+    while lower <= high:
+        partitions.append(Partition("p%d" % lower if lower >= 0 else "m%d" % -lower, str(lower), str(lower + width)))
+        lower += width
+    if len(partitions) < 2:
+        return None
+    return PartitionPlan(column, "integer", partitions, estimated_rows)
+
+
+def _truncate(day, unit):
+    # type: (datetime.date, str)->datetime.date
+    if unit == "month":
+        return day.replace(day=1)
+    elif unit == "year":
+        return day.replace(month=1, day=1)
+    return day
+
+
+def _next(day, unit):
+    # type: (datetime.date, str)->datetime.date
+    if unit == "month":
+        return (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    elif unit == "year":
+        return day.replace(year=day.year + 1)
+    return day + datetime.timedelta(days=1)
+
+
+def plan_date_partitions(column, kind, values, estimated_rows, target_rows):
+    # type: (str, str, List[Any], int, int)->Optional[PartitionPlan]
+    """
+    picks the finest calendar unit whose partitions would hold at least a quarter of `target_rows`
+    (assuming rows are spread evenly over the sampled range) without exceeding MAX_PARTITIONS.
+    """
+    if len(values) < 2:
+        return None
+    days = [v.date() if isinstance(v, datetime.datetime) else v for v in values]
+    low, high = min(days), max(days)
+    span_days = (high - low).days + 1
+    rows_per_day = float(estimated_rows) / span_days
+
+    chosen = DATE_UNITS[-1][0]
+    for unit, unit_days in DATE_UNITS:
+        if rows_per_day * unit_days >= target_rows / 4.0 and span_days / unit_days <= MAX_PARTITIONS:
+            chosen = unit
+            break
+
+    formats = {"day": "%Y%m%d", "month": "%Y%m", "year": "%Y"}
+    partitions = list()
+    lower = _truncate(low, chosen)
+    while lower <= high:
+        upper = _next(lower, chosen)
+        partitions.append(Partition("p" + lower.strftime(formats[chosen]), "'%s'" % lower.isoformat(), "'%s'" % upper.isoformat()))
+        lower = upper
+    if len(partitions) < 2 or len(partitions) > MAX_PARTITIONS:
+        return None
+    return PartitionPlan(column, kind, partitions, estimated_rows)
+
+
+def plan_partitions(candidates, estimated_rows, target_rows=DEFAULT_PARTITION_ROWS):
+    # type: (List[Tuple[str, type, List[str]]], int, int)->Optional[PartitionPlan]
+    """
+    `candidates` are (column name, inferred python type, sampled values in file order followed by the values
+    at the end of the file). date and timestamp columns are preferred over integers.
+    returns None when the file is too small to be worth partitioning or no column suits.
+    """
+    if estimated_rows < 2 * target_rows:
+        return None
+    for name, python_type, raw_values in candidates:
+        if python_type in (datetime.date, datetime.datetime):
+            values = [v for v in [parse_value(python_type, r) for r in raw_values] if v is not None]
+            kind = "date" if python_type == datetime.date else "timestamp"
+            plan = plan_date_partitions(name, kind, values, estimated_rows, target_rows)
+            if plan is not None:
+                return plan
+    for name, python_type, raw_values in candidates:
+        if python_type in (int, BigInt):
+            values = [v for v in [parse_value(python_type, r) for r in raw_values] if v is not None]
+            plan = plan_integer_partitions(name, values, estimated_rows, target_rows)
+            if plan is not None:
+                return plan
+    return None
@@ -0,0 +1,85 @@
+from typing import Callable, Optional, Any
+
+from progress import Progress
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+DEFAULT_HEAD_BYTES = 1 << 22
+
+
+def row_end(data, quotechar='"'):
+    # type: (bytes, str)->int
+    """
+    the offset just after the last complete row in `data`, which starts at the start of a row. a newline inside
+    a quoted field doesn't end a row: before it, the number of quote chars is odd. 0 if there's no complete row.
+    """
+    quote = quotechar.encode("ascii")
+    end = data.rfind(b"\n")
+    while end >= 0 and data.count(quote, 0, end) % 2:
+        end = data.rfind(b"\n", 0, end)
+    return end + 1
+
+
+class RowFeed(object):
+    """
+    reads a binary file once, front to back, in chunks that end on row boundaries. every byte is read from the
+    file exactly once; the partial row at the end of a chunk is carried over to the start of the next.
+    """
+    def __init__(self, f, quotechar='"', chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        # type: (Any, str, int, Optional[Progress])->None
+        self.f = f
+        self.quotechar = quotechar
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.carry = b""
+        self.eof = False
+
+    def next_chunk(self, size=None):
+        # type: (Optional[int])->bytes
+        """ the next run of complete rows of about `size` bytes, or b"" at the end of the file. """
+        while not self.eof:
+            data = self.f.read(size or self.chunk_size)
+            if self.progress is not None:
+                self.progress.advance(len(data))
+            if not data:
+                self.eof = True
+                break
+            data = self.carry + data
+            end = row_end(data, self.quotechar)
+            if end > 0:
+                self.carry = data[end:]
+                return data[:end]
+            # a single row longer than the chunk.
+            self.carry = data
+        chunk, self.carry = self.carry, b""
+        return chunk
+
+
+class CopySource(object):
+    """
+    the file object a `copy_expert(COPY ... FROM STDIN)` reads from. it passes on the rows of a `RowFeed`,
+    starting with `first`, but shows every new chunk to `check` before COPY sees it. if `check` returns
+    something true, that chunk is held back and the COPY ends cleanly before it, so the table can be altered
+    before the held chunk is sent with the next COPY.
+    """
+    def __init__(self, feed, first=b"", check=None):
+        # type: (RowFeed, bytes, Optional[Callable[[bytes], Any]])->None
+        self.feed = feed
+        self.buffer = first
+        self.check = check
+        self.held = None  # type: Optional[bytes]
+        self.reason = None  # type: Any
+
+    def read(self, size=-1):
+        # type: (int)->bytes
+        if not self.buffer and self.held is None:
+            chunk = self.feed.next_chunk()
+            if chunk and self.check is not None:
+                self.reason = self.check(chunk)
+                if self.reason:
+                    self.held = chunk
+                    return b""
+            self.buffer = chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
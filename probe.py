@@ -0,0 +1,107 @@
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, Any
+
+from core import Server, PGPassEntry, connect, logger
+
+
+class ProbeResult(object):
+    def __init__(self, server, credential):
+        # type: (Server, PGPassEntry)->None
+        self.server = server
+        self.credential = credential
+        self.connect_time = None  # seconds
+        self.latency = None  # seconds, median round trip of a trivial query
+        self.write_rows_per_second = None
+        self.write_bytes_per_second = None
+        self.active_backends = None
+        self.error = None  # type: Optional[Exception]
+
+    @property
+    def reachable(self):
+        return self.error is None and self.latency is not None
+
+    def to_line(self):
+        if not self.reachable:
+            return "%-20s unreachable: %s" % (self.server.name, self.error)
+        return "%-20s connect: %7.1f ms  latency: %7.2f ms  write: %10.0f rows/s (%6.2f MB/s)  active backends: %s" % (
+            self.server.name,
+            self.connect_time * 1000.0,
+            self.latency * 1000.0,
+            self.write_rows_per_second,
+            self.write_bytes_per_second / (1024.0 * 1024.0),
+            self.active_backends,
+        )
+
+
+def probe_server(server, credential, round_trips=10, write_rows=10000, connect_timeout=5):
+    # type: (Server, PGPassEntry, int, int, int)->ProbeResult
+    """ connects to a single server and measures connect time, round-trip latency and COPY write throughput. """
+    result = ProbeResult(server, credential)
+    try:
+        started = time.perf_counter()
+        connection = connect(server, credential, connect_timeout=connect_timeout,
+                             application_name="psql_utils_probe")
+        result.connect_time = time.perf_counter() - started
+        try:
+            with connection.cursor() as cursor:
+                timings = list()
+                for _ in range(round_trips):
+                    started = time.perf_counter()
+                    cursor.execute("SELECT 1;")
+                    cursor.fetchone()
+                    timings.append(time.perf_counter() - started)
+                timings.sort()
+                result.latency = timings[len(timings) // 2]
+
+                cursor.execute("SELECT count(*) FROM pg_stat_activity WHERE state = 'active' AND pid <> pg_backend_pid();")
+                result.active_backends = cursor.fetchone()[0]
+
+                # a temp table is invisible to other sessions and is dropped along with the connection.
+                cursor.execute("CREATE TEMP TABLE psql_utils_probe (i INTEGER, t TEXT);")
+                payload = "".join(["%d\tprobe-row-%d\n" % (i, i) for i in range(write_rows)]).encode("utf8")
+                started = time.perf_counter()
+                cursor.copy_expert("COPY psql_utils_probe FROM STDIN;", io.BytesIO(payload))
+                connection.commit()
+                elapsed = time.perf_counter() - started
+                result.write_rows_per_second = write_rows / elapsed
+                result.write_bytes_per_second = len(payload) / elapsed
+        finally:
+            connection.close()
+    except Exception as e:
+        logger.error("Probe of server '%s' failed: %s" % (server.name, e))
+        result.error = e
+    return result
+
+
+def probe_servers(targets, max_workers=None, **probe_kwargs):
+    # type: (List[Tuple[Server, PGPassEntry]], int, Any)->List[ProbeResult]
+    """ probes every (server, credential) pair concurrently. results are returned in the order of `targets`. """
+    if not any(targets):
+        return list()
+    max_workers = max_workers or len(targets)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(probe_server, server, credential, **probe_kwargs) for server, credential in targets]
+        return [f.result() for f in futures]
+
+
+def select_fastest(results, criterion="latency"):
+    # type: (List[ProbeResult], str)->Optional[ProbeResult]
+    """
+    picks the best reachable result.
+        criterion='latency': lowest round-trip latency.
+        criterion='throughput': highest write throughput.
+        criterion='load': fewest active backends, ties broken by latency.
+    """
+    reachable = [r for r in results if r.reachable]
+    if not any(reachable):
+        return None
+    if criterion == "latency":
+        return min(reachable, key=lambda r: r.latency)
+    elif criterion == "throughput":
+        return max(reachable, key=lambda r: r.write_rows_per_second)
+    elif criterion == "load":
+        return min(reachable, key=lambda r: (r.active_backends, r.latency))
+    else:
+        raise ValueError("Unknown criterion: %s" % criterion)
@@ -0,0 +1,159 @@
+import io
+import os
+import json
+import time
+from collections import Counter
+from typing import Any, Optional
+
+from core import logger
+
+
+class Progress(object):
+    """
+    cheap counters for long-running passes over a file: rows, bytes, per-column events.
+    the clock is only consulted every `check_every` updates, and a line is emitted through `logger`
+    (and appended to `metrics_file` as json, if given) at most once per `interval` seconds.
+    """
+    check_every = 1024
+
+    def __init__(self, label, total_bytes=None, interval=5.0, metrics_file=None):
+        # type: (str, Optional[int], float, Optional[str])->None
+        self.label = label
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.metrics_file = metrics_file
+        self.rows = 0
+        self.offset = 0  # bytes consumed so far, as reported by the reader or the caller.
+        self.initial_offset = 0  # where reading started, when it didn't start at the beginning of the file.
+        self.events = Counter()
+        self.started = time.perf_counter()
+        self.last_emitted = self.started
+        self.__until_check = self.check_every
+
+    def update(self, rows=1, offset=None):
+        # type: (int, Optional[int])->None
+        self.rows += rows
+        if offset is not None:
+            self.offset = offset
+        self.__until_check -= rows
+        if self.__until_check <= 0:
+            self.__until_check = self.check_every
+            if time.perf_counter() - self.last_emitted >= self.interval:
+                self.emit()
+
+    def advance(self, nbytes):
+        # type: (int)->None
+        self.offset += nbytes
+
+    def count(self, column, event, n=1):
+        # type: (str, str, int)->None
+        self.events[(column, event)] += n
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def bytes_per_second(self):
+        elapsed = self.elapsed
+        return (self.offset - self.initial_offset) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        # type: ()->Optional[float]
+        """ seconds left, assuming the remaining bytes go at the average rate so far. """
+        if self.total_bytes is None or self.offset <= self.initial_offset:
+            return None
+        return max(0.0, self.total_bytes - self.offset) / self.bytes_per_second
+
+    def snapshot(self):
+        # type: ()->dict
+        return {
+            "label": self.label,
+            "time": time.time(),
+            "elapsed": self.elapsed,
+            "rows": self.rows,
+            "bytes": self.offset,
+            "total_bytes": self.total_bytes,
+            "rows_per_second": self.rows_per_second,
+            "bytes_per_second": self.bytes_per_second,
+            "eta": self.eta,
+            "events": {"%s:%s" % key: n for key, n in self.events.items()},
+        }
+
+    def emit(self, final=False):
+        self.last_emitted = time.perf_counter()
+        eta = self.eta
+        logger.info("%s: %d rows, %.1f MB (%.0f rows/s, %.2f MB/s)%s%s" % (
+            self.label,
+            self.rows,
+            self.offset / (1024.0 * 1024.0),
+            self.rows_per_second,
+            self.bytes_per_second / (1024.0 * 1024.0),
+            "" if eta is None or final else ", eta %.0fs" % eta,
+            " - done in %.1fs" % self.elapsed if final else "",
+        ))
+        if self.metrics_file is not None:
+            with open(self.metrics_file, 'a', encoding='utf8') as f:
+                f.write(json.dumps(self.snapshot()) + "\n")
+
+    def finish(self):
+        self.emit(final=True)
+        if any(self.events):
+            for (column, event), n in sorted(self.events.items()):
+                logger.info("\t%s: %s x%d" % (column, event, n))
+
+    def wrap(self, raw):
+        # type: (io.RawIOBase)->ProgressReader
+        return ProgressReader(raw, self)
+
+
+class ProgressReader(io.RawIOBase):
+    """ a raw binary stream that reports every byte read to a `Progress`. """
+    def __init__(self, raw, progress):
+        # type: (Any, Progress)->None
+        super().__init__()
+        self.raw = raw
+        self.progress = progress
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.raw.readinto(b)
+        if n:
+            self.progress.advance(n)
+        return n
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+def open_with_progress(filepath, progress, mode='r', start_offset=0, **open_kwargs):
+    # type: (str, Progress, str, int, Any)->Any
+    """
+    opens `filepath` like `open()`, but with the byte offset tracked by `progress`.
+    text-mode files can't `tell()` while being iterated, so the count is taken below the text layer.
+    reading starts at `start_offset`, which must be the start of a line.
+    """
+    if progress.total_bytes is None:
+        progress.total_bytes = os.path.getsize(filepath)
+    raw = open(filepath, 'rb', buffering=0)
+    if start_offset:
+        raw.seek(start_offset)
+        progress.offset = progress.initial_offset = start_offset
+    buffered = io.BufferedReader(progress.wrap(raw))
+    if 'b' in mode:
+        return buffered
+    return io.TextIOWrapper(buffered, **open_kwargs)
+
+
+def metrics_file_from_environment():
+    # type: ()->Optional[str]
+    return os.environ.get("PSQL_UTILS_METRICS_FILE") or None
@@ -0,0 +1,121 @@
+import io
+import re
+import sys
+import csv
+from typing import List, Generator, Any, Sequence
+
+# matches the `NULL '\N'` of the generated COPY statements.
+NULL_MARKER = "\\N"
+
+def is_blank(record):
+    # type: (str)->bool
+    return record in ("\n", "\r\n")
+
+
+class Projection(object):
+    """
+    reads only the selected fields of each CSV record.
+    a record is matched by one compiled regex, up to the last selected field, in which only the selected
+    fields are capturing groups. so unselected fields never become python strings and fields after the
+    last selected one are never looked at.
+    blank records are skipped. a record too short to have every selected field gets NULL_MARKER for the
+    missing ones, so COPY sees the row and a NOT NULL column reports it, where an exception would end the load.
+    """
+    def __init__(self, indices, delimiter=",", quotechar="\""):
+        # type: (Sequence[int], str, str)->None
+        self.indices = sorted(set(indices))
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+        q = re.escape(quotechar)
+        d = re.escape(delimiter)
+        field = r'%s(?:[^%s]|%s%s)*%s|[^%s%s\r\n]*' % (q, q, q, q, q, d, q)
+        selected = set(self.indices)
+        parts = [("(%s)" if i in selected else "(?:%s)") % field for i in range(self.indices[-1] + 1)]
+        self.__match = re.compile(d.join(parts)).match
+        # for short records only: every field after the first is optional, along with all the ones after it.
+        pattern = ""
+        for part in reversed(parts[1:]):
+            pattern = "(?:%s%s%s)?" % (d, part, pattern)
+        self.__match_short = re.compile(parts[0] + pattern).match
+        self.__escaped_quote = quotechar * 2
+
+    @classmethod
+    def from_names(cls, header, names, **kwargs):
+        # type: (List[str], List[str], Any)->Projection
+        missing = [n for n in names if n not in header]
+        if any(missing):
+            raise KeyError("Columns not found in header: %s" % ", ".join(missing))
+        return cls([header.index(n) for n in names], **kwargs)
+
+    def records(self, f, skip_blank=True):
+        # type: (Any, bool)->Generator[str]
+        """
+        yields complete records from a text file opened with newline='', joining lines split inside quotes.
+        without `skip_blank`, blank records are yielded too, so records can be counted the way the row index does.
+        """
+        pending = None
+        for line in f:
+            if pending is not None:
+                line = pending + line
+            if line.count(self.quotechar) % 2:
+                pending = line
+                continue
+            pending = None
+            if skip_blank and is_blank(line):
+                continue
+            yield line
+        if pending is not None:
+            yield pending
+
+    def raw_fields(self, record):
+        # type: (str)->Sequence[str]
+        """ the selected fields exactly as they appear in the file, quotes included. """
+        match = self.__match(record) or self.__match_short(record)
+        if match is None or match.end() < len(record.rstrip("\r\n")) and record[match.end()] not in (self.delimiter, "\r", "\n"):
+            raise ValueError("Could not parse record: %r" % record[:200])
+        return [NULL_MARKER if field is None else field for field in match.groups()]
+
+    def unquote(self, field):
+        # type: (str)->str
+        if field.startswith(self.quotechar):
+            return field[1:-1].replace(self.__escaped_quote, self.quotechar)
+        return field
+
+    def fields(self, record):
+        # type: (str)->List[str]
+        """ the selected fields of a record, unquoted. """
+        unquote = self.unquote
+        return [unquote(field) for field in self.raw_fields(record)]
+
+    def rows(self, f):
+        # type: (Any)->Generator[List[str]]
+        fields = self.fields
+        for record in self.records(f):
+            yield fields(record)
+
+    def write_csv(self, f, out):
+        # type: (Any, Any)->None
+        """ copies the selected columns of `f` to `out` as CSV, without unquoting and re-quoting them. """
+        delimiter = self.delimiter
+        for record in self.records(f):
+            out.write(delimiter.join(self.raw_fields(record)) + "\n")
+
+
+def read_header(filepath, delimiter=",", quotechar="\"", encoding="utf8"):
+    # type: (str, str, str, str)->List[str]
+    with open(filepath, 'r', encoding=encoding, newline="") as f:
+        return next(csv.reader(f, delimiter=delimiter, quotechar=quotechar))
+
+
+if __name__ == '__main__':
+    # usage: python projection.py <csv file, or - for stdin> <comma-separated column indices> [encoding]
+    # writes the projected CSV to stdout as UTF-8, so psql's `\copy ... FROM PROGRAM` can load it.
+    indices = [int(i) for i in sys.argv[2].split(",")]
+    encoding = sys.argv[3] if len(sys.argv) > 3 else "utf8"
+    out = io.TextIOWrapper(sys.stdout.buffer, encoding="utf8", newline="")
+    if sys.argv[1] == "-":
+        Projection(indices).write_csv(io.TextIOWrapper(sys.stdin.buffer, encoding=encoding, newline=""), out)
+    else:
+        with open(sys.argv[1], 'r', encoding=encoding, newline="") as f:
+            Projection(indices).write_csv(f, out)
+    out.flush()
@@ -0,0 +1,180 @@
+import os
+import re
+import json
+import glob
+import time
+import shutil
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, Any
+
+from core import Server, PGPassEntry, Manager, PGPassFile, Config, logger
+
+DEFAULT_JOBS = 4
+
+
+def major_version(version):
+    # type: (str)->str
+    """ '9.6.24' -> '9.6', '16.2' -> '16'. the major version was two numbers before postgres 10. """
+    parts = re.findall(r"\d+", str(version))
+    if not any(parts):
+        return ""
+    if int(parts[0]) < 10 and len(parts) > 1:
+        return "%s.%s" % (parts[0], parts[1])
+    return parts[0]
+
+
+def find_psql(server_version, cli_library_root, configured_version=None):
+    # type: (str, str, Optional[str])->str
+    """
+    looks for `<cli_library_root>/<major version>/bin/psql`, the layout of Debian's postgresql-client packages.
+    it tries the server's own version, then the version configured under [psql], then the newest installed one
+    that isn't older than the server (a newer psql can talk to an older server), and finally psql on the PATH.
+    """
+    def path(version):
+        return os.path.join(cli_library_root, version, "bin", "psql")
+
+    candidates = [major_version(server_version)]
+    if configured_version:
+        candidates.append(major_version(configured_version))
+    if os.path.isdir(cli_library_root):
+        installed = sorted([v for v in os.listdir(cli_library_root) if os.path.isfile(path(v))],
+                           key=lambda v: [int(n) for n in re.findall(r"\d+", v)], reverse=True)
+        server_major = [int(n) for n in re.findall(r"\d+", major_version(server_version))]
+        candidates += [v for v in installed if [int(n) for n in re.findall(r"\d+", v)] >= server_major]
+    for version in candidates:
+        if version and os.path.isfile(path(version)):
+            return path(version)
+    on_path = shutil.which("psql")
+    if on_path is None:
+        raise FileNotFoundError("No psql found for server version '%s' under '%s' or on the PATH." % (
+            server_version, cli_library_root))
+    return on_path
+
+
+def psql_from_config(server):
+    # type: (Server)->str
+    config = Config().config
+    return find_psql(server.version, config.get("cli", "cli_library_root", fallback="/usr/lib/postgresql/"),
+                     config.get("psql", "version", fallback=None))
+
+
+class ScriptResult(object):
+    def __init__(self, path, server):
+        # type: (str, Server)->None
+        self.path = path
+        self.server = server
+        self.returncode = None  # type: Optional[int]
+        self.wall_time = None  # type: Optional[float]
+        self.stdout = ""
+        self.stderr = ""
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def serialize(self):
+        return {"path": self.path, "server": self.server.name, "returncode": self.returncode,
+                "wall_time": self.wall_time, "stdout": self.stdout, "stderr": self.stderr}
+
+    def to_line(self):
+        lines = self.stderr.strip().splitlines()
+        errors = [line for line in lines if "ERROR" in line or "FATAL" in line] or lines[-1:]
+        first_error = errors[0] if any(errors) else ""
+        return "%-4s %-15s %8.2fs  %s%s" % (
+            "ok" if self.ok else "FAIL", self.server.name, self.wall_time or 0.0, self.path,
+            "" if self.ok else "\n\t\t" + first_error)
+
+
+def run_script(psql, server, credential, path, on_error_stop=True, single_transaction=False, timeout=None):
+    # type: (str, Server, PGPassEntry, str, bool, bool, Optional[float])->ScriptResult
+    """
+    runs one script with psql, from the script's directory, without reading ~/.psqlrc.
+    with `on_error_stop`, psql exits at the first failed statement with status 3.
+    with -q, psql only prints query results, such as the row counts of a merge script; they're kept in `stdout`.
+    """
+    result = ScriptResult(path, server)
+    command = [psql, "-X", "-q", "-h", server.host, "-p", str(server.port), "-U", credential.username,
+               "-d", credential.db, "-v", "ON_ERROR_STOP=%d" % (1 if on_error_stop else 0), "-f", path]
+    if single_transaction:
+        command.insert(-2, "--single-transaction")
+    env = dict(os.environ, PGPASSWORD=credential.password, PGAPPNAME="psql_utils_runner")
+    started = time.perf_counter()
+    try:
+        completed = subprocess.run(command, cwd=os.path.dirname(os.path.abspath(path)), env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+        result.returncode = completed.returncode
+        result.stdout = completed.stdout.decode("utf8", errors="replace")
+        result.stderr = completed.stderr.decode("utf8", errors="replace")
+    except subprocess.TimeoutExpired as e:
+        result.returncode = -1
+        result.stdout = (e.stdout or b"").decode("utf8", errors="replace")
+        result.stderr = (e.stderr or b"").decode("utf8", errors="replace") + "\ntimed out after %ss" % timeout
+    result.wall_time = time.perf_counter() - started
+    return result
+
+
+def run_scripts(targets, paths, jobs=DEFAULT_JOBS, **run_kwargs):
+    # type: (List[Tuple[Server, PGPassEntry]], List[str], int, Any)->List[ScriptResult]
+    """
+    runs every script against every (server, credential) target. each server gets its own pool of `jobs`
+    workers, so one slow server doesn't hold up the others, and none gets more than `jobs` sessions at once.
+    results are in the order of `targets`, then `paths`.
+    """
+    pools = list()
+    futures = list()
+    try:
+        for server, credential in targets:
+            psql = psql_from_config(server)
+            logger.info("Running %d script(s) on '%s' with %s, %d at a time." % (len(paths), server.name, psql, jobs))
+            pool = ThreadPoolExecutor(max_workers=jobs)
+            pools.append(pool)
+            futures += [pool.submit(run_script, psql, server, credential, path, **run_kwargs) for path in paths]
+        results = list()
+        for future in futures:
+            result = future.result()
+            logger.info(result.to_line())
+            if result.stdout.strip():
+                logger.info("\n".join(["\t\t" + line for line in result.stdout.strip().splitlines()]))
+            results.append(result)
+        return results
+    finally:
+        for pool in pools:
+            pool.shutdown()
+
+
+def write_summary(results, summary_file):
+    # type: (List[ScriptResult], str)->None
+    with open(summary_file, 'w', encoding='utf8') as f:
+        json.dump([r.serialize() for r in results], f, indent=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run generated .sql scripts with psql, several at a time.")
+    parser.add_argument("scripts", nargs="+", help="script files or glob patterns.")
+    parser.add_argument("--server", action="append", required=True, help="name in servers.json; repeatable.")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="scripts running at once, per server.")
+    parser.add_argument("--single-transaction", action="store_true",
+                        help="wrap each script in one transaction. not for scripts with their own BEGIN/COMMIT.")
+    parser.add_argument("--continue-on-error", action="store_true", help="don't stop a script at its first error.")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds per script.")
+    parser.add_argument("--summary", default=None, help="write the results to this json file.")
+    arguments = parser.parse_args()
+
+    paths = [os.path.abspath(p) for pattern in arguments.scripts for p in sorted(glob.glob(pattern))]
+    targets = list()
+    for name in arguments.server:
+        server = Manager.Servers()[name]
+        credentials = PGPassFile().filter(server=server)
+        if not any(credentials):
+            raise KeyError("No credential found for server '%s'" % name)
+        targets.append((server, credentials[0]))
+    results = run_scripts(targets, paths, jobs=arguments.jobs, on_error_stop=not arguments.continue_on_error,
+                          single_transaction=arguments.single_transaction, timeout=arguments.timeout)
+    if arguments.summary:
+        write_summary(results, arguments.summary)
+    failed = [r for r in results if not r.ok]
+    print("%d script run(s): %d ok, %d failed, %.1fs of psql time." % (
+        len(results), len(results) - len(failed), len(failed), sum([r.wall_time for r in results])))
+    raise SystemExit(1 if any(failed) else 0)
@@ -1,10 +1,31 @@
-import re
+import io
 import sys
 import os
 import csv
-from typing import List, Dict, Tuple, Set, Generator
+import shlex
+import argparse
+from typing import List, Dict, Tuple, Set, Generator, Optional
 from collections import Counter
-import math
+from itertools import zip_longest
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from progress import Progress, open_with_progress, metrics_file_from_environment
+from inference import RuleSet, ColumnInference, SampleConvergence, infer_columns, MAX_SAMPLE_ROWS, BigInt
+from projection import Projection
+from columnar import EncodedColumn, SampleStore, ColumnStatistics
+from csv_index import header_end, last_row_end, count_rows, RowIndex
+from incremental import LoadState, plan_evolution, prefix_digest, Evolution
+from partitioning import PartitionPlan, plan_partitions, DEFAULT_PARTITION_ROWS
+from advisor import ColumnProfile, profile_column, recommend, index_name
+from uniqueness import verify_unique, DEFAULT_MEMORY_BUDGET
+from copy_table import server_and_credential
+from core import connect
+from arrow_input import is_columnar_file, open_batches, sql_type as arrow_sql_type
+from pipeline import RowFeed, CopySource, DEFAULT_HEAD_BYTES
+from verification import LoadChecksum
+from text_encoding import UTF8, Utf8Reader, detect_encoding
+from copy_monitor import CopyMonitor
 
 
 has_header = True
@@ -13,38 +34,89 @@ quotechar = "\""
 newline = "\n"
 
 
-FILE_ARGUMENT = sys.argv[1]
+parser = argparse.ArgumentParser(description="Infer a table definition from a CSV file and write the SQL to load it.")
+parser.add_argument("file")
+parser.add_argument("schema")
+parser.add_argument("--columns", help="comma-separated names of the only columns to infer and load.")
+parser.add_argument("--incremental", action="store_true",
+                    help="the file is append-only: load only the rows added since the last load.")
+parser.add_argument("--merge", action="store_true",
+                    help="upsert into the existing table on the detected primary key instead of replacing it.")
+parser.add_argument("--partition", action="store_true",
+                    help="range-partition large files on a date, timestamp or ever-increasing integer column.")
+parser.add_argument("--partition-rows", type=int, default=DEFAULT_PARTITION_ROWS,
+                    help="rows to aim for per partition (default: %(default)d).")
+parser.add_argument("--advise", action="store_true",
+                    help="also write `<file>.indexes.sql`, with the indexes and statistics targets the sample suggests.")
+parser.add_argument("--verify-key", action="store_true",
+                    help="check the detected primary key over the whole file, not just the sample.")
+parser.add_argument("--memory", type=int, default=DEFAULT_MEMORY_BUDGET >> 20,
+                    help="MB of memory --verify-key may use across all cores (default: %(default)d).")
+parser.add_argument("--load", metavar="SERVER", default=None,
+                    help="instead of writing SQL, stream the file into the table on this server, reading it only once.")
+parser.add_argument("--monitor", action="store_true",
+                    help="with --load, watch the COPY from a second connection and append a performance record "
+                         "to `<file>.perf.jsonl`.")
+parser.add_argument("--jobs", type=int, default=1,
+                    help="split the COPY into this many scripts, `<file>.load-<n>.sql`, that can run in parallel.")
+ARGUMENTS = parser.parse_args()
+
+
+def given_flags(names):
+    # type: (List[str])->List[str]
+    """ the options among `names` that were set to something other than their default, as typed. """
+    return ["--" + name.replace("_", "-") for name in names if getattr(ARGUMENTS, name) != parser.get_default(name)]
+
+
+FILE_ARGUMENT = ARGUMENTS.file
 FILE_ARGUMENT = os.path.normpath(os.path.abspath(FILE_ARGUMENT))
 print(FILE_ARGUMENT)
 assert os.path.isfile(FILE_ARGUMENT)
 
-STAGING_SCHEMA_NAME = sys.argv[2]
+STAGING_SCHEMA_NAME = ARGUMENTS.schema
+# how the file's bytes are text, detected from its head. Parquet and Arrow files aren't text.
+ENCODING = UTF8 if is_columnar_file(FILE_ARGUMENT) else detect_encoding(FILE_ARGUMENT)
+PROJECTED_COLUMNS = ARGUMENTS.columns.split(",") if ARGUMENTS.columns else None
+
+# extend or replace the inference rules here, e.g. RuleSet(DEFAULT_RULES + [Rule(...)]).
+rules = RuleSet()
+# rows read between checks whether the sampled columns have converged.
+SAMPLE_BATCH_ROWS = 1024
 
 
 class ColumnValues(object):
-    null_values = ["\\N"]
     invalid_values = [('""', "Postgres /COPY can't process empty string \"\". Have you cleaned the file yet?")]
 
-    def __init__(self):
-        # type: ()->None
-        self.__raw_values = list()  # list of strings
+    def __init__(self, encoded=None):
+        # type: (EncodedColumn)->None
+        self.encoded = encoded if encoded is not None else EncodedColumn()
         self.nullable = False  # by default.
-        self.__possible_types = [str, int, float]
         self.python_type = None  # by default
-        self.__value_counts = Counter(self.__raw_values)
-        # self.__max_length = 0
+        self.declared_type = None  # the sql type, when the file says what it is and nothing has to be inferred.
+        self.inference = None  # type: ColumnInference  # kept, so values seen after sampling can still be added.
 
     def add(self, value):
         # type: (str)->None
-        # self.__max_length = max(self.__max_length, len(value))
-        self.__raw_values.append(value)
+        self.encoded.append(value)
+
+    def extend(self, values):
+        # type: (List[str])->None
+        self.encoded.extend(values)
 
     @property
     def sql_type(self):
-        if self.python_type == int:
+        if self.declared_type is not None:
+            return self.declared_type
+        elif self.python_type == int:
             return "INTEGER"
+        elif self.python_type == BigInt:
+            return "BIGINT"
         elif self.python_type == float:
             return "NUMERIC"
+        elif self.python_type == datetime.date:
+            return "DATE"
+        elif self.python_type == datetime.datetime:
+            return "TIMESTAMP"
         elif self.python_type == str:
             # postgres TEXT is more useful than you'd expect:
             # https://www.depesz.com/2010/03/02/charx-vs-varcharx-vs-varchar-vs-text/
@@ -52,7 +124,7 @@ class ColumnValues(object):
 
     def check_for_invalid_values(self):
         invalid_values = [iv for iv, err in self.invalid_values]
-        found = [v for v in self.__raw_values if v in invalid_values]
+        found = [v for v in self.encoded.dictionary if v in invalid_values]
         if any(found):
             found = list(set(found))
             for f in found:
@@ -60,87 +132,40 @@ class ColumnValues(object):
                 print(err)
             raise Exception("Invalid values found in file '%s'!" % FILE_ARGUMENT)
 
-    def infer_types(self, verbose=False):
-        # the following types are supported: str (TEXT), int (INTEGER), float (NUMERIC)
-        # possible_types = [str, int, float]
-
-        def force(value, rule, _type):
+    def infer_types(self, verbose=False, progress=None, name=None):
+        # type: (bool, Progress, str)->None
+        # the following types are supported: str (TEXT), int (INTEGER), BigInt (BIGINT), float (NUMERIC)
+        inference = self.inference = ColumnInference(rules)
+        inference.add_counts(self.statistics.frequencies(self.encoded.dictionary))
+        for rule, n in inference.events.items():
+            if progress is not None:
+                progress.count(name, rule, n)
             if verbose:
-                print("Rule '%s' forced type '%s' on value '%s'" % (rule, _type, value))
-            self.__possible_types = [_type]
-
-        def remove(value, rule, _type):
-            if _type in self.__possible_types:
-                if verbose:
-                    print("Rule '%s' eliminated type '%s' for value '%s'" % (rule, _type, value))
-                self.__possible_types.remove(_type)
-
-        def eliminate_types(raw_value):
-            if re.search('[a-zA-Z]', raw_value):
-                force(raw_value, "CONTAINS_ALPHA", str)
-                return
-            if raw_value.count(".") > 1:
-                force(raw_value, "MULTI_DECIMAL", str)
-                return
-            elif raw_value.count(".") == 1:
-                remove(raw_value, "SINGLE_DECIMAL", int)
-            elif raw_value.count(".") == 0:
-                if raw_value.startswith("0") and raw_value != "0":
-                    remove(raw_value, "LEADING_ZERO", int)
-
-        # loop over values.
-        for v in [str(v) for v in self.__raw_values]:
-            if len(self.__possible_types) == 1:
-                # there can be only one
-                break
-
-            if v in self.null_values:
-                self.nullable = True
-                continue  # null values don't tell you about types.
+                print("Rule '%s' matched %d value(s) of column '%s'" % (rule, n, name))
 
-            eliminate_types(v)
+        self.nullable = self.nullable or inference.nullable
+        self.python_type = inference.python_type
 
-        # finally, pick the strictest remaining possible type.
-        def pick_strictest_type():
-            if len(self.__possible_types) == 1:
-                return self.__possible_types[0]
-            else:
-                if int in self.__possible_types:
-                    return int
-                elif float in self.__possible_types:
-                    return float
-                elif str in self.__possible_types:
-                    return str
-                else:
-                    raise ValueError()
-
-        self.python_type = pick_strictest_type()
-        self.__value_counts = Counter(self.__raw_values)
+    @property
+    def statistics(self):
+        # type: ()->ColumnStatistics
+        return self.encoded.statistics(rules.null_values)
 
     def get_summary(self):
-        num_values_total = len(self.__raw_values)
-        num_values_unique = len(list(set(self.__raw_values)))
-        value_counts = Counter(self.__raw_values)
-        return num_values_total, num_values_unique, value_counts
+        statistics = self.statistics
+        return statistics.rows, statistics.distinct, Counter(statistics.frequencies(self.encoded.dictionary))
 
     @property
     def entropy(self):
-        unique_values = list(self.__value_counts.keys())
-        num_observations = len(self.__raw_values)
-        P = {value: float(count)/float(num_observations) for value, count in self.__value_counts.items()}
-        assert abs(sum(P.values()) - 1.0) < 0.001, sum(P.values())
-        I = {value: -math.log(P[value], math.e) for value in unique_values}
-        H = sum([P[value]*I[value] for value in unique_values])
-        return H
+        return self.statistics.entropy
 
     @property
     def is_possible_key_column(self):
         if self.python_type in [float]:
             return False
-        elif self.python_type in [int, str]:
-            H = self.entropy
-            H0 = self.entropy_if_uniform
-            if abs(H - H0) > 0.00001:
+        elif self.python_type in [int, BigInt, str]:
+            statistics = self.statistics
+            if abs(statistics.entropy - statistics.entropy_if_uniform) > 0.00001:
                 return False  # not uniform enough.
             else:
                 return True
@@ -148,38 +173,26 @@ class ColumnValues(object):
     @property
     def entropy_if_uniform(self):
         """ the entropy expected if this column's unique values were uniformly distributed. """
-        unique_values = list(self.__value_counts.keys())
-        num_observations = len(self.__raw_values)
-        expected_counts_if_uniform = float(num_observations) / float(len(unique_values))
-        P = {value: expected_counts_if_uniform / float(num_observations) for value, count in
-             self.__value_counts.items()}
-        assert abs(sum(P.values()) - 1.0) < 0.001, sum(P.values())
-        I = {value: -math.log(P[value], math.e) for value in unique_values}
-        H = sum([P[value] * I[value] for value in unique_values])
-        return H
+        return self.statistics.entropy_if_uniform
 
     @property
     def max_entropy(self):
-        num_observations = len(self.__raw_values)
-        P = 1.0/float(num_observations)
-        I = -math.log(P, math.e)
-        H = P*I*num_observations
-        return H
+        return self.statistics.max_entropy
 
 
 class Column(object):
-    def __init__(self, idx, name):
-        # type: (int, str)->None
+    def __init__(self, idx, name, encoded=None):
+        # type: (int, str, EncodedColumn)->None
         self.idx = idx
         self.name = name
-        self.values = ColumnValues()
+        self.values = ColumnValues(encoded)
 
     def print_summary(self):
-        num_values_total, num_values_unique, value_counts = self.values.get_summary()
+        statistics = self.values.statistics
         print("\nColumn #%d - %s" % (self.idx, self.name))
         print("\t\tType: %s" % (self.values.python_type))
-        print("\t\tnum_values: %s total (%s unique)" % (num_values_total, num_values_unique))
-        print("\t\tentropy: %s (expected if uniform: %s)" % (self.values.entropy, self.values.entropy_if_uniform))
+        print("\t\tnum_values: %s total (%s unique)" % (statistics.rows, statistics.distinct))
+        print("\t\tentropy: %s (expected if uniform: %s)" % (statistics.entropy, statistics.entropy_if_uniform))
 
     @property
     def column_creation_expression(self):
@@ -193,10 +206,14 @@ class Column(object):
 class ColumnCollection(object):
     def __init__(self):
         self.items = list()
+        self.__by_idx = dict()
+        self.__by_name = dict()
 
     def add(self, column):
         # type: (Column)->None
         self.items.append(column)
+        self.__by_idx[column.idx] = column
+        self.__by_name[column.name] = column
 
     def __iter__(self):
         # type: ()->Generator[Column]
@@ -205,26 +222,37 @@ class ColumnCollection(object):
 
     def getByIdx(self, idx):
         # type: (int)->Column
-        return [item for item in self.items if item.idx == idx][0]
+        """ by position in the file, which differs from the position in `items` when columns are projected. """
+        return self.__by_idx[idx]
 
     def getByName(self, name):
         # type: (str)->Column
-        return [item for item in self.items if item.name == name][0]
+        return self.__by_name[name]
 
 
 class Table(object):
-    def __init__(self, schema, name):
-        # type: (str, str)->None
+    def __init__(self, schema, name, projected_columns=None):
+        # type: (str, str, List[str])->None
         self.schema = schema
         self.name = name
         self.columns = ColumnCollection()
-        self.rows = list()
-
-    def sample(self, sample_size, verbose=False):
-        # type: (int)->None
+        self.store = None  # type: SampleStore  # sampled rows of the projected columns, one encoded column each.
+        self.projected_columns = projected_columns
+        self.projection = None  # type: Projection
+        self.header = None  # type: List[str]
+        self.primary_key = list()  # type: List[Column]
+        self.partition_plan = None  # type: PartitionPlan
+
+    def sample(self, sample_size=MAX_SAMPLE_ROWS, verbose=False, start_offset=None):
+        # type: (int, bool, int)->None
+        """
+        samples from the first data row, or from `start_offset` (the start of a row) if given. sampling stops
+        at `sample_size` rows, or earlier, once every column's type and nullability have settled.
+        """
         filepath = FILE_ARGUMENT
         # header = has_header
-        open_kwargs = {"encoding": "utf8"}
+        # a byte the detected encoding doesn't have only spoils that value, which COPY will then reject.
+        open_kwargs = {"encoding": ENCODING.python, "errors": "replace"}
         reader_kwargs = {"delimiter": delimiter, "quotechar": quotechar}
 
         def get_column_names():
@@ -236,35 +264,108 @@ class Table(object):
                 else:
                     return list(["c_%d" % column for column in first_row])
 
-        column_names = get_column_names()
-        for idx, name in enumerate(column_names):
-            self.columns.add(Column(idx, name))
+        self.set_columns(get_column_names())
+        metrics_file = metrics_file_from_environment()
 
         def sample_values():
-            n = 0
-            with open(filepath, 'r', **open_kwargs) as f:
-                reader = csv.reader(f, **reader_kwargs)
-                if has_header:
+            progress = Progress("Sampling %s" % os.path.basename(filepath), metrics_file=metrics_file)
+            with open_with_progress(filepath, progress, newline="", start_offset=start_offset or 0, **open_kwargs) as f:
+                if self.projection is None:
+                    reader = csv.reader(f, **reader_kwargs)
+                else:
+                    reader = self.projection.rows(f)
+                if has_header and start_offset is None:
                     header_row = next(reader)
-                for data_row in reader:
-                    self.rows.append(data_row)
-                    for idx, value in enumerate(data_row):
-                        self.columns.getByIdx(idx).values.add(value)
-                    n += 1
-                    if n > sample_size:
-                        break
+
+                def counted(rows):
+                    for row in rows:
+                        progress.update()
+                        yield row
+
+                convergence = SampleConvergence(len(self.store.columns), rules)
+
+                def converged(start, end):
+                    return convergence.add(end - start, lambda idx: self.store.columns[idx].value_counts_between(start, end))
+
+                self.store.load(counted(reader), limit=sample_size + 1, until=converged, batch_size=SAMPLE_BATCH_ROWS)
+            progress.finish()
+            if convergence.done:
+                print("Sampled %d rows: every column's type had settled for the last %d." % (
+                    self.store.num_rows, convergence.rows_needed))
+            elif self.store.num_rows > sample_size:
+                print("Sampled the maximum of %d rows; still uncertain: %s." % (
+                    sample_size, ", ".join([self.columns.items[idx].name for idx in convergence.uncertain])))
 
         # sample rows.
         sample_values()
 
-        # infer types.
+        self.infer_types(verbose=verbose)
+
+    def set_columns(self, column_names):
+        # type: (List[str])->None
+        self.header = column_names
+        if self.projected_columns is None:
+            indices = range(len(column_names))
+        else:
+            self.projection = Projection.from_names(column_names, self.projected_columns,
+                                                    delimiter=delimiter, quotechar=quotechar)
+            indices = self.projection.indices
+        self.store = SampleStore(len(indices))
+        for idx, encoded in zip(indices, self.store.columns):
+            self.columns.add(Column(idx, column_names[idx], encoded))
+
+    def infer_types(self, verbose=False):
+        progress = Progress("Inferring types", metrics_file=metrics_file_from_environment())
         for column in self.columns:
-            column.values.infer_types(verbose=verbose)
+            column.values.infer_types(verbose=verbose, progress=progress, name=column.name)
+        progress.update(rows=self.store.num_rows)
+        progress.finish()
 
         if verbose:
             for column in self.columns:
                 column.print_summary()
 
+    def sample_head(self, head, verbose=False, codec="utf8"):
+        # type: (bytes, bool, str)->None
+        """ samples every row of `head`, the first complete rows of the file, header included if it has one. """
+        reader = csv.reader(io.StringIO(head.decode(codec, errors="replace"), newline=""),
+                            delimiter=delimiter, quotechar=quotechar)
+        first_row = next(reader)
+        self.set_columns(list(first_row) if has_header else ["c_%d" % column for column in range(len(first_row))])
+        if not has_header:
+            self.store.append_rows([first_row])
+        self.store.load(reader, limit=float("inf"))
+        self.infer_types(verbose=verbose)
+
+    def observe(self, data, codec="utf8"):
+        # type: (bytes, str)->Tuple[int, List[Counter]]
+        """
+        adds the values of more complete rows to the columns' inferences, and updates their types.
+        returns the number of rows and the value counts of each column.
+        """
+        text = data.decode(codec, errors="replace")
+        rows = list(csv.reader(io.StringIO(text, newline=""), delimiter=delimiter, quotechar=quotechar))
+        column_counts = list()
+        for column, values in zip(self.columns, zip_longest(*rows)):
+            counts = Counter(values)
+            counts.pop(None, None)
+            column.values.inference.add_counts(counts)
+            column.values.python_type = column.values.inference.python_type
+            column.values.nullable = column.values.nullable or column.values.inference.nullable
+            column_counts.append(counts)
+        return len(rows), column_counts
+
+    def read_columnar_schema(self):
+        """ for Parquet and Arrow files, which carry their own types: the columns are declared, not sampled. """
+        schema, batches = open_batches(FILE_ARGUMENT, self.projected_columns)
+        self.header = list(schema.names)
+        self.store = SampleStore(len(schema))
+        for idx, (field, encoded) in enumerate(zip(schema, self.store.columns)):
+            column = Column(idx, field.name, encoded)
+            column.values.declared_type = arrow_sql_type(field.type)
+            column.values.nullable = field.nullable
+            self.columns.add(column)
+
     def detect_primary_keys(self):
         """ assumes the primary key will always be made up by the left-most columns. """
         print("\n\n","###" * 30, "Script will now attempt to detect the table's primary key column(s)...")
@@ -278,44 +379,121 @@ class Table(object):
         #     column.print_summary()
 
         def check_candidate_key(num_columns):
-            # type: (int)->Column
-            columns = list([self.columns.getByIdx(idx) for idx in range(num_columns)])
-            candidate_key = Column(-1, "candidate_key")
-            for row in self.rows:
-                value = ",".join(['"%s"' % row[idx] for idx in range(num_columns)])
-                candidate_key.values.add(value)
-            candidate_key.values.infer_types()
-            table_entropy = candidate_key.values.max_entropy
-            key_entropy = candidate_key.values.entropy
-            if abs(table_entropy - key_entropy) < 0.001:
+            # type: (int)->Counter
+            columns = self.columns.items[:num_columns]
+            # the key's entropy only reaches the table's max entropy if every combination of codes is unique.
+            key_counts = self.store.key_counts(list(range(num_columns)))
+            if len(key_counts) == self.store.num_rows:
                 print("Entropy analysis suggested the following primary key: ")
-                for idx in range(num_columns):
-                    column = self.columns.getByIdx(idx)
+                for column in columns:
                     column.print_summary()
-                return candidate_key
+                return key_counts
 
         def get_primary_key_length():
+            if self.store.num_rows == 0:
+                return None
             for nc in range(len(self.columns.items)):
-                c = self.columns.getByIdx(nc)
-                if c.values.entropy == c.values.max_entropy:
-                    return None
-                found = check_candidate_key(nc)
-                if found is not None:
+                if nc > 0 and check_candidate_key(nc) is not None:
                     return nc
+                # a column of distinct values completes the key. counted, not compared by entropy: entropy and
+                # max_entropy are float sums that only sometimes come out exactly equal.
+                statistics = self.columns.items[nc].values.statistics
+                if statistics.distinct == statistics.rows:
+                    check_candidate_key(nc + 1)
+                    return nc + 1
 
         key_length = get_primary_key_length()
-        for idx in range(key_length):
-            c = self.columns.getByIdx(idx)
+        if key_length is None:
+            print("No primary key detected.")
+            return
+        self.primary_key = self.columns.items[:key_length]
+        for c in self.primary_key:
             if c.values.python_type != str:
                 print("Primary key column %s will be forcibly cast to string" % c.name)
                 c.values.python_type = str
 
         print("All non-primary key columns will be forcibly made nullable.")
-        for idx in range(key_length, len(list(self.columns))):
-            c = self.columns.getByIdx(idx)
+        for c in self.columns.items[key_length:]:
             c.values.nullable = True
 
 
+    def estimate_row_count(self, head_bytes=1 << 20):
+        # type: (int)->int
+        """ the file size divided by the average size of the rows in the first `head_bytes` after the header. """
+        data_start = header_end(FILE_ARGUMENT, quotechar) if has_header else 0
+        size = os.path.getsize(FILE_ARGUMENT) - data_start
+        head_rows = count_rows(FILE_ARGUMENT, data_start, min(data_start + head_bytes, data_start + size), quotechar)
+        if head_rows == 0:
+            return 0
+        return int(size / (float(min(head_bytes, size)) / head_rows))
+
+    def tail_rows(self, tail_bytes=1 << 20):
+        # type: (int)->List[List[str]]
+        """ the rows of the projected columns in the last `tail_bytes` of the file, without the first, partial one. """
+        size = os.path.getsize(FILE_ARGUMENT)
+        data_start = header_end(FILE_ARGUMENT, quotechar) if has_header else 0
+        start = max(data_start, size - tail_bytes)
+        with open(FILE_ARGUMENT, 'rb') as f:
+            f.seek(start)
+            data = f.read()
+        if start > data_start:
+            data = data[data.find(b"\n") + 1:]
+        # the seek may have landed inside a multi-byte character, but only in the skipped line.
+        lines = io.StringIO(data.decode(ENCODING.codec, errors="replace"), newline="")
+        if self.projection is not None:
+            rows = list(self.projection.rows(lines))
+        else:
+            rows = list(csv.reader(lines, delimiter=delimiter, quotechar=quotechar))
+        # a tail that started inside a quoted field can't be told apart from a damaged one; skip what doesn't fit.
+        return [row for row in rows if len(row) == len(self.columns.items)]
+
+    def plan_partitions(self, target_rows, candidates=None):
+        # type: (int, List[Column])->Optional[PartitionPlan]
+        """
+        looks for a date, timestamp or ever-increasing integer column to range-partition on. the range is taken
+        from the sample and the end of the file, the number of rows from the file size.
+        """
+        estimated_rows = self.estimate_row_count()
+        tail = self.tail_rows()
+        candidates = candidates if candidates is not None else self.columns.items
+        positions = {c.name: p for p, c in enumerate(self.columns.items)}
+        self.partition_plan = plan_partitions(
+            [(c.name, c.values.python_type, c.values.encoded.values() + [row[positions[c.name]] for row in tail])
+             for c in candidates],
+            estimated_rows, target_rows)
+        if self.partition_plan is None:
+            print("Not partitioning: about %d rows, and no column suits a range of %d-row partitions." % (
+                estimated_rows, target_rows))
+        else:
+            print("Partitioning about %d rows on column '%s' into %d partitions." % (
+                estimated_rows, self.partition_plan.column, len(self.partition_plan.partitions)))
+        return self.partition_plan
+
+    def verify_primary_key(self, memory_budget):
+        # type: (int)->bool
+        """ streams the whole file to check the key found in the sample. forgets the key if it isn't unique. """
+        if not any(self.primary_key):
+            return False
+        report = verify_unique(FILE_ARGUMENT, [c.name for c in self.primary_key], memory_budget=memory_budget,
+                               has_header=has_header, delimiter=delimiter, quotechar=quotechar,
+                               encoding=ENCODING.python)
+        report.print_summary()
+        if not report.unique:
+            print("The detected primary key is not unique over the whole file, and won't be used.")
+            self.primary_key = list()
+        return report.unique
+
+    def profile_columns(self):
+        # type: ()->List[ColumnProfile]
+        key = set([c.name for c in self.primary_key])
+        return [profile_column(c.name, c.values.python_type, c.values.encoded.dictionary, c.values.encoded.codes,
+                               rules.null_values, is_key=c.name in key) for c in self.columns]
+
+    def column_states(self):
+        # type: ()->List[Dict]
+        return [{"name": c.name, "type": c.values.sql_type, "nullable": c.values.nullable} for c in self.columns]
+
+
 class SQLGrammar(object):
     def __init__(self, table):
         # type: (Table)->None
@@ -324,43 +502,454 @@ class SQLGrammar(object):
     def make_drop_table_statement(self):
         return "DROP TABLE IF EXISTS {schema}.\"{table}\";".format(schema=self.table.schema, table=self.table.name)
 
-    def make_create_table_statement(self):
-        return "CREATE TABLE {schema}.\"{table}\" ({columns});".format(
+    def make_create_table_statement(self, if_not_exists=False):
+        columns = [c.column_creation_expression for c in self.table.columns]
+        if if_not_exists and any(self.table.primary_key):
+            # ON CONFLICT needs a unique index on the key to merge into.
+            columns.append("PRIMARY KEY (%s)" % ", ".join(['"%s"' % c.name for c in self.table.primary_key]))
+        return "CREATE TABLE {if_not_exists}{schema}.\"{table}\" ({columns}){partitioning};".format(
+            if_not_exists="IF NOT EXISTS " if if_not_exists else "",
             schema=self.table.schema,
             table=self.table.name,
-            columns=", ".join([c.column_creation_expression for c in self.table.columns])
+            columns=", ".join(columns),
+            partitioning="" if self.table.partition_plan is None else
+            " PARTITION BY RANGE (\"%s\")" % self.table.partition_plan.column,
         )
 
-    def copy_statement(self):
-        return "COPY {schema}.\"{table}\" FROM '{filepath}' WITH CSV {header} NULL AS '\\N';".format(
+    def make_create_partition_statements(self):
+        # type: ()->List[str]
+        """ one table per range of the partition plan, plus a default partition for rows outside all of them. """
+        plan = self.table.partition_plan
+        if plan is None:
+            return list()
+        statements = list()
+        for partition in plan.partitions:
+            statements.append(
+                "CREATE TABLE {schema}.\"{table}_{suffix}\" PARTITION OF {target} FOR VALUES FROM ({lower}) TO ({upper});".format(
+                    schema=self.table.schema, table=self.table.name, suffix=partition.suffix, target=self.target,
+                    lower=partition.lower, upper=partition.upper))
+        statements.append("CREATE TABLE {schema}.\"{table}_default\" PARTITION OF {target} DEFAULT;".format(
+            schema=self.table.schema, table=self.table.name, target=self.target))
+        return statements
+
+    @property
+    def target(self):
+        return "{schema}.\"{table}\"".format(schema=self.table.schema, table=self.table.name)
+
+    @staticmethod
+    def copy_options(header=False, encoding=None):
+        # type: (bool, Optional[str])->str
+        """ the CSV options of generated COPY statements: the file's ENCODING, unless it's re-encoded on the way. """
+        return "WITH (FORMAT csv{header}, NULL '\\N', ENCODING '{encoding}')".format(
+            header=", HEADER" if header else "", encoding=encoding or ENCODING.copy_encoding)
+
+    def copy_statement(self, target=None):
+        if self.table.projection is not None or ENCODING.postgres is None:
+            return self.projected_copy_statement(target)
+        return "COPY {target} FROM '{filepath}' {options};".format(
+            target=target or self.target,
+            filepath=FILE_ARGUMENT,
+            options=self.copy_options(header=has_header),
+        )
+
+    def projected_copy_statement(self, target=None):
+        """
+        a server-side COPY has to read every field of the file, so projected loads go through psql's client-side
+        `\\copy ... FROM PROGRAM`, with projection.py writing only the selected columns. so do files COPY can't
+        read as they are, in UTF-16 or with a BOM: projection.py writes all their columns, as UTF-8.
+        """
+        if self.table.projection is not None:
+            indices = self.table.projection.indices
+        else:
+            indices = [c.idx for c in self.table.columns]
+        program = " ".join([shlex.quote(a) for a in [
+            sys.executable,
+            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "projection.py"),
+            FILE_ARGUMENT,
+            ",".join([str(i) for i in indices]),
+            ENCODING.python,
+        ]])
+        return "\\copy {target} ({columns}) FROM PROGRAM '{program}' {options};".format(
+            target=target or self.target,
+            columns=", ".join(['"%s"' % c.name for c in self.table.columns]),
+            program=program.replace("'", "''"),
+            options=self.copy_options(header=has_header, encoding="UTF8"),
+        )
+
+    def columnar_copy_statement(self):
+        """
+        psql runs arrow_input.py, which streams the record batches out as CSV. it writes nulls as empty fields,
+        which is COPY's default for CSV.
+        """
+        program = " ".join([shlex.quote(a) for a in [
+            sys.executable,
+            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "arrow_input.py"),
+            FILE_ARGUMENT,
+        ] + ([",".join([c.name for c in self.table.columns])] if self.table.projected_columns else [])])
+        return "\\copy {target} ({columns}) FROM PROGRAM '{program}' WITH CSV;".format(
+            target=self.target,
+            columns=", ".join(['"%s"' % c.name for c in self.table.columns]),
+            program=program.replace("'", "''"),
+        )
+
+    def make_merge_statements(self):
+        # type: ()->List[str]
+        """
+        loads the file into a temp staging table, then applies it to the target with one set-based statement:
+        MERGE on postgres 15+, INSERT ... ON CONFLICT before that. rows whose values didn't change aren't
+        rewritten, and psql prints how many rows were inserted, updated and left unchanged.
+        """
+        if not any(self.table.primary_key):
+            raise ValueError("Merging needs a primary key, and none was detected for '%s'." % self.table.name)
+        columns = ['"%s"' % c.name for c in self.table.columns]
+        key = ['"%s"' % c.name for c in self.table.primary_key]
+        values = [c for c in columns if c not in key]
+        staging = '"%s_staging"' % self.table.name
+        fmt = {
+            "target": self.target,
+            "staging": staging,
+            "columns": ", ".join(columns),
+            "key": ", ".join(key),
+            "first_key": key[0],
+            "join": " AND ".join(["target.%s = staging.%s" % (k, k) for k in key]),
+            "changed": "(%s) IS DISTINCT FROM (%s)" % (
+                ", ".join(["target.%s" % c for c in values]), ", ".join(["staging.%s" % c for c in values])),
+            "excluded_changed": "(%s) IS DISTINCT FROM (%s)" % (
+                ", ".join(["target.%s" % c for c in values]), ", ".join(["EXCLUDED.%s" % c for c in values])),
+            "set": ", ".join(["%s = EXCLUDED.%s" % (c, c) for c in values]),
+            "merge_set": ", ".join(["%s = staging.%s" % (c, c) for c in values]),
+            "staging_columns": ", ".join(["staging.%s" % c for c in columns]),
+        }
+        if not any(values):
+            # a table that is all key can only gain rows.
+            fmt["changed"] = fmt["excluded_changed"] = "FALSE"
+        names = ", ".join(["'%s'" % c.name.replace("'", "''") for c in self.table.primary_key])
+        statements = [
+            "\\set ON_ERROR_STOP on",
+            self.make_create_table_statement(if_not_exists=True),
+            # a table that already existed may have no unique index on the key, which ON CONFLICT needs.
+            ("SELECT NOT EXISTS (SELECT 1 FROM pg_index i WHERE i.indrelid = '{quoted_target}'::regclass "
+             "AND i.indisunique AND i.indpred IS NULL AND i.indexprs IS NULL AND i.indnkeyatts = {key_length} "
+             "AND ARRAY[{names}]::name[] <@ ARRAY(SELECT a.attname FROM pg_attribute a "
+             "WHERE a.attrelid = i.indrelid AND a.attnum = ANY((i.indkey::int2[])[0:i.indnkeyatts - 1]))"
+             ") AS add_key \\gset").format(quoted_target=self.target.replace("'", "''"),
+                                            key_length=len(key), names=names),
+            "\\if :add_key",
+            "ALTER TABLE {target} ADD UNIQUE ({key});".format(**fmt),
+            "\\endif",
+            "BEGIN;",
+            "CREATE TEMP TABLE {staging} (LIKE {target} INCLUDING DEFAULTS) ON COMMIT DROP;".format(**fmt),
+            self.copy_statement(target=staging),
+            # a key that occurs twice in the file would make both statements fail, so the last occurrence wins.
+            "DELETE FROM {staging} a USING {staging} b WHERE ({a_key}) = ({b_key}) AND a.ctid < b.ctid;".format(
+                a_key=", ".join(["a.%s" % k for k in key]), b_key=", ".join(["b.%s" % k for k in key]), **fmt),
+            "SELECT current_setting('server_version_num')::int >= 150000 AS use_merge \\gset",
+            "\\if :use_merge",
+            ("SELECT count(*) FILTER (WHERE target.{first_key} IS NULL) AS inserted, "
+             "count(*) FILTER (WHERE target.{first_key} IS NOT NULL AND {changed}) AS updated, "
+             "count(*) FILTER (WHERE target.{first_key} IS NOT NULL AND NOT {changed}) AS unchanged "
+             "FROM {staging} staging LEFT JOIN {target} target ON {join};").format(**fmt),
+            ("MERGE INTO {target} target USING {staging} staging ON {join} "
+             + ("WHEN MATCHED AND {changed} THEN UPDATE SET {merge_set} " if any(values) else "")
+             + "WHEN NOT MATCHED THEN INSERT ({columns}) VALUES ({staging_columns});").format(**fmt),
+            "\\else",
+            ("WITH upserted AS ("
+             "INSERT INTO {target} AS target ({columns}) SELECT {columns} FROM {staging} "
+             "ON CONFLICT ({key}) DO " + ("UPDATE SET {set} WHERE {excluded_changed} " if any(values) else "NOTHING ")
+             + "RETURNING (xmax = 0) AS inserted) "
+             "SELECT count(*) FILTER (WHERE inserted) AS inserted, count(*) FILTER (WHERE NOT inserted) AS updated, "
+             "(SELECT count(*) FROM {staging}) - count(*) AS unchanged FROM upserted;").format(**fmt),
+            "\\endif",
+            "COMMIT;",
+        ]
+        return statements
+
+    def write_merge_statements_to_file(self):
+        # built first: without a primary key this raises, and the last script should be left as it was.
+        statements = self.make_merge_statements()
+        with open(self.sql_filepath(), 'w') as f:
+            f.write("\n".join(statements) + "\n")
+
+    def make_alter_table_statements(self, evolution):
+        # type: (Evolution)->List[str]
+        target = "{schema}.\"{table}\"".format(schema=self.table.schema, table=self.table.name)
+        statements = list()
+        for c in evolution.added:
+            statements.append("ALTER TABLE %s ADD COLUMN \"%s\" %s NULL;" % (target, c["name"], c["type"]))
+        for name, old_type, new_type in evolution.widened:
+            statements.append("ALTER TABLE %s ALTER COLUMN \"%s\" TYPE %s USING \"%s\"::%s;" % (
+                target, name, new_type, name, new_type))
+        for name in evolution.relaxed:
+            statements.append("ALTER TABLE %s ALTER COLUMN \"%s\" DROP NOT NULL;" % (target, name))
+        return statements
+
+    def range_copy_statement(self, start, end):
+        # type: (int, int)->str
+        """ loads only the rows in the byte range [start, end) of the file, which holds no header. """
+        # a headerless file's first range would otherwise start with the BOM.
+        start = max(start, len(ENCODING.bom))
+        program = "tail -c +%d %s | head -c %d" % (start + 1, shlex.quote(FILE_ARGUMENT), end - start)
+        encoding = None
+        if self.table.projection is not None:
+            program += " | " + " ".join([shlex.quote(a) for a in [
+                sys.executable,
+                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "projection.py"),
+                "-",
+                ",".join([str(i) for i in self.table.projection.indices]),
+                ENCODING.python,
+            ]])
+            encoding = "UTF8"
+        return "\\copy {schema}.\"{table}\" ({columns}) FROM PROGRAM '{program}' {options};".format(
             schema=self.table.schema,
             table=self.table.name,
-            filepath=FILE_ARGUMENT,
-            header=" HEADER " if has_header else " ",
+            columns=", ".join(['"%s"' % c.name for c in self.table.columns]),
+            program=program.replace("'", "''"),
+            options=self.copy_options(encoding=encoding),
         )
 
-    def write_ddl_statements_to_file(self):
+    def write_incremental_statements_to_file(self, statements, start, end):
+        # type: (List[str], int, int)->None
+        """
+        runs the statements and the range COPY in one transaction. psql then moves the pending load state
+        into place, and only if everything succeeded, because ON_ERROR_STOP ends the script at the first error.
+        """
+        lines = ["\\set ON_ERROR_STOP on", "BEGIN;"] + statements + [self.range_copy_statement(start, end), "COMMIT;"]
+        lines.append("\\! mv %s %s" % (shlex.quote(LoadState.pending_path(FILE_ARGUMENT)),
+                                        shlex.quote(LoadState.sidecar_path(FILE_ARGUMENT))))
+        with open(self.sql_filepath(), 'w') as f:
+            f.write("\n".join(lines) + "\n")
+
+    @staticmethod
+    def sql_filepath():
         filepath = FILE_ARGUMENT
-        drop = self.make_drop_table_statement()
-        create = self.make_create_table_statement()
-        copy = self.copy_statement()
-        sql = drop + "\n" + create + "\n" + copy + "\n"
-
         filename = os.path.basename(filepath)
         sql_filename = filename + ".sql"
-        sql_filepath = os.path.join(os.path.dirname(filepath), sql_filename)
-        with open(sql_filepath, 'w') as f:
+        return os.path.join(os.path.dirname(filepath), sql_filename)
+
+    def make_advice_statements(self):
+        # type: ()->List[str]
+        """ optional indexes and statistics targets, each after a comment saying why, then an ANALYZE. """
+        # a merged table has its primary key, whose index already serves lookups on the key's leading column.
+        covered = self.table.primary_key[0].name if ARGUMENTS.merge and any(self.table.primary_key) else None
+        statements = list()
+        for profile in self.table.profile_columns():
+            for r in recommend(profile):
+                if r.kind != "statistics" and r.column == covered:
+                    continue
+                statements.append("-- %s: %s" % (r.column, r.reason))
+                if r.kind == "statistics":
+                    statements.append("ALTER TABLE %s ALTER COLUMN \"%s\" SET STATISTICS %d;" % (
+                        self.target, r.column, r.statistics_target))
+                else:
+                    statements.append("CREATE INDEX IF NOT EXISTS \"{name}\" ON {target} USING {kind} (\"{column}\");".format(
+                        name=index_name(self.table.name, r.column, r.kind).replace('"', '""'), column=r.column,
+                        kind=r.kind, target=self.target))
+        statements.append("ANALYZE %s;" % self.target)
+        return statements
+
+    def write_advice_statements_to_file(self):
+        with open(self.sql_filepath()[:-len(".sql")] + ".indexes.sql", 'w') as f:
+            f.write("\n".join(self.make_advice_statements()) + "\n")
+
+    @staticmethod
+    def chunk_sql_filepath(n):
+        # type: (int)->str
+        return SQLGrammar.sql_filepath()[:-len(".sql")] + ".load-%d.sql" % n
+
+    def write_ddl_statements_to_file(self, jobs=1):
+        # type: (int)->None
+        """
+        with `jobs` > 1, the main script only creates the table, and each `<file>.load-<n>.sql` copies one
+        byte range of the file. they can run concurrently once the main script has; a partitioned parent
+        routes every row to its partition.
+        """
+        filepath = FILE_ARGUMENT
+        drop = self.make_drop_table_statement()
+        create = self.make_create_table_statement()
+        statements = [drop, create] + self.make_create_partition_statements()
+        if jobs <= 1:
+            statements.append(self.copy_statement())
+        else:
+            data_start = header_end(filepath, quotechar) if has_header else 0
+            chunks = [(max(start, data_start), end) for start, end in
+                      RowIndex.for_file(filepath, quotechar=quotechar).chunks(jobs) if end > data_start]
+            for n, (start, end) in enumerate(chunks):
+                with open(self.chunk_sql_filepath(n), 'w') as f:
+                    f.write(self.range_copy_statement(start, end) + "\n")
+            print("Wrote %d load scripts to run in parallel after %s." % (len(chunks), self.sql_filepath()))
+        sql = "\n".join(statements) + "\n"
+
+        with open(self.sql_filepath(), 'w') as f:
             f.write(sql)
         pass
 
 
 def run_v2():
+    table_name = str(os.path.basename(FILE_ARGUMENT).split(".")[0])
+    table = Table(schema=STAGING_SCHEMA_NAME, name=table_name, projected_columns=PROJECTED_COLUMNS)
+    table.sample(verbose=False)
+    table.detect_primary_keys()
+    if ARGUMENTS.verify_key:
+        table.verify_primary_key(ARGUMENTS.memory << 20)
+    if ARGUMENTS.partition:
+        if ARGUMENTS.merge:
+            # postgres needs the partition column in the primary key, and key columns are loaded as TEXT.
+            print("Not partitioning: merged tables are keyed on text columns.")
+        else:
+            table.plan_partitions(ARGUMENTS.partition_rows)
+    sql = SQLGrammar(table)
+    if ARGUMENTS.merge:
+        sql.write_merge_statements_to_file()
+    else:
+        sql.write_ddl_statements_to_file(jobs=ARGUMENTS.jobs)
+    if ARGUMENTS.advise:
+        sql.write_advice_statements_to_file()
+
+
+def run_columnar():
+    unsupported = given_flags(["merge", "incremental", "load", "partition", "jobs", "advise", "verify_key"])
+    if any(unsupported):
+        raise ValueError("%s can't be used with Parquet or Arrow files: they are always loaded whole, into a new "
+                         "table." % ", ".join(unsupported))
+    table_name = str(os.path.basename(FILE_ARGUMENT).split(".")[0])
+    table = Table(schema=STAGING_SCHEMA_NAME, name=table_name, projected_columns=PROJECTED_COLUMNS)
+    table.read_columnar_schema()
+    for column in table.columns:
+        print("Column '%s': %s" % (column.name, column.column_creation_expression))
+    sql = SQLGrammar(table)
+    statements = [sql.make_drop_table_statement(), sql.make_create_table_statement(), sql.columnar_copy_statement()]
+    with open(sql.sql_filepath(), 'w') as f:
+        f.write("\n".join(statements) + "\n")
+
+
+def run_pipelined(server_name):
+    """
+    loads the file over one connection and reads it only once: the head decides the columns, the table is
+    created, and then the head and the rest of the file stream into COPY FROM STDIN. every chunk is checked
+    on the way: if its values don't fit a column any more, the COPY stops before it, the column is widened
+    with ALTER TABLE, and a new COPY carries on with that chunk. it all commits, or fails, as one transaction.
+    before the commit, the row count and per-column checksums of what was sent are compared with one
+    aggregate query over the table, so a load that silently lost or changed values fails instead.
+    """
+    unsupported = given_flags(["columns", "merge", "incremental", "partition", "jobs", "advise", "verify_key"])
+    if any(unsupported):
+        raise ValueError("--load can't be combined with %s: it always loads the whole file into a new table, over "
+                         "one connection." % ", ".join(unsupported))
+    server, credential = server_and_credential(server_name)
     table_name = str(os.path.basename(FILE_ARGUMENT).split(".")[0])
     table = Table(schema=STAGING_SCHEMA_NAME, name=table_name)
-    table.sample(sample_size=10000, verbose=False)
+    sql = SQLGrammar(table)
+    progress = Progress("Loading %s" % os.path.basename(FILE_ARGUMENT), total_bytes=os.path.getsize(FILE_ARGUMENT),
+                        metrics_file=metrics_file_from_environment())
+
+    with open(FILE_ARGUMENT, 'rb') as f:
+        if ENCODING.postgres is None:
+            # COPY can't read the file as it is, so it gets UTF-8; the progress still counts the file's bytes.
+            feed = RowFeed(Utf8Reader(progress.wrap(f), ENCODING), quotechar=quotechar)
+            codec = "utf8"
+        else:
+            feed = RowFeed(f, quotechar=quotechar, progress=progress)
+            codec = ENCODING.codec
+        head = feed.next_chunk(DEFAULT_HEAD_BYTES)
+        table.sample_head(head, codec=codec)
+        progress.update(rows=head.count(b"\n"))
+        checksum = LoadChecksum([c.name for c in table.columns], ["\\N"])
+        checksum.add(table.store.num_rows, [c.values.encoded.value_counts() for c in table.columns],
+                     [c["type"] for c in table.column_states()])
+
+        def check(chunk):
+            progress.update(rows=chunk.count(b"\n"))
+            previous = table.column_states()
+            rows, column_counts = table.observe(chunk, codec=codec)
+            # the chunk goes in after any ALTER TABLE, so it's loaded as the columns' new types.
+            checksum.add(rows, column_counts, [c["type"] for c in table.column_states()])
+            evolution = plan_evolution(previous, table.column_states())
+            return evolution if evolution.changed else None
+
+        connection = connect(server, credential, application_name="psql_utils_load")
+        monitor = None  # type: Optional[CopyMonitor]
+        if ARGUMENTS.monitor:
+            # the progress of the file is already logged; the monitor only reports stalls while it runs.
+            monitor = CopyMonitor(server, credential, connection.get_backend_pid(), label=FILE_ARGUMENT,
+                                  relation=sql.target, log_progress=False).start()
+        try:
+            with connection.cursor() as cursor:
+                # the checksums hash each value's text, which for dates and timestamps depends on DateStyle, and
+                # so does the text an ALTER ... TYPE TEXT widening stores for them: both must be ISO, like the file.
+                cursor.execute("SET LOCAL DateStyle = 'ISO';")
+                cursor.execute(sql.make_drop_table_statement())
+                cursor.execute(sql.make_create_table_statement())
+                source = CopySource(feed, first=head, check=check)
+                header = has_header
+                while True:
+                    cursor.copy_expert("COPY {target} FROM STDIN {options};".format(
+                        target=sql.target, options=sql.copy_options(header=header)), source)
+                    header = False
+                    if source.held is None:
+                        break
+                    for statement in sql.make_alter_table_statements(source.reason):
+                        print(statement)
+                        cursor.execute(statement)
+                    source = CopySource(feed, first=source.held, check=check)
+                cursor.execute(checksum.server_query(sql.target))
+                mismatches = checksum.compare(cursor.fetchone(), [c["type"] for c in table.column_states()])
+            if any(mismatches):
+                for mismatch in mismatches:
+                    print(mismatch)
+                raise Exception("The loaded table doesn't match '%s'; nothing was committed." % FILE_ARGUMENT)
+            print("Verified %d rows and the checksums of %d columns." % (checksum.rows, len(checksum.columns)))
+            connection.commit()
+        finally:
+            if monitor is not None:
+                record = monitor.stop()
+                print(record.to_line())
+                record.save(FILE_ARGUMENT + ".perf.jsonl")
+            connection.close()
+    progress.finish()
+
+
+def run_incremental():
+    table_name = str(os.path.basename(FILE_ARGUMENT).split(".")[0])
+    state = LoadState.load(FILE_ARGUMENT)
+    data_start = header_end(FILE_ARGUMENT, quotechar) if has_header else 0
+    end = last_row_end(FILE_ARGUMENT)
+
+    if state is None:
+        print("No previous load recorded; loading the whole file.")
+    elif not state.is_prefix_of(FILE_ARGUMENT, data_start):
+        print("The previously loaded rows have changed; reloading the whole file.")
+    else:
+        start = data_start + state.offset - state.data_start
+        if end <= start:
+            print("No new rows since the last load.")
+            # so that running the previous script again can't load the same rows twice.
+            with open(SQLGrammar.sql_filepath(), 'w') as f:
+                f.write("-- no new rows since the last load.\n")
+            return
+        table = Table(schema=STAGING_SCHEMA_NAME, name=table_name, projected_columns=PROJECTED_COLUMNS)
+        table.sample(verbose=False, start_offset=start)
+        evolution = plan_evolution(state.columns, table.column_states())
+        if evolution is not None:
+            sql = SQLGrammar(table)
+            row_count = count_rows(FILE_ARGUMENT, start, end, quotechar)
+            print("Appending %d new rows (%d bytes)%s." % (
+                row_count, end - start, " with schema changes" if evolution.changed else ""))
+            sql.write_incremental_statements_to_file(sql.make_alter_table_statements(evolution), start, end)
+            LoadState(table.header, data_start, end, state.row_count + row_count,
+                      prefix_digest(FILE_ARGUMENT, data_start, end), evolution.columns
+                      ).save(LoadState.pending_path(FILE_ARGUMENT))
+            return
+        print("The columns changed in a way that can't be applied in place; reloading the whole file.")
+
+    table = Table(schema=STAGING_SCHEMA_NAME, name=table_name, projected_columns=PROJECTED_COLUMNS)
+    table.sample(verbose=False)
     table.detect_primary_keys()
     sql = SQLGrammar(table)
-    sql.write_ddl_statements_to_file()
+    statements = [sql.make_drop_table_statement(), sql.make_create_table_statement()]
+    sql.write_incremental_statements_to_file(statements, data_start, end)
+    LoadState(table.header, data_start, end, count_rows(FILE_ARGUMENT, data_start, end, quotechar),
+              prefix_digest(FILE_ARGUMENT, data_start, end), table.column_states()
+              ).save(LoadState.pending_path(FILE_ARGUMENT))
 
 
 def run():
@@ -399,8 +988,6 @@ def run():
         # type: (int)->Tuple[Dict[int, type], Set[int]]
         with open(filepath, 'r', **open_kwargs) as f:
             reader = csv.reader(f, **reader_kwargs)
-            null_values = [r"\N", "", "%s%s" % (quotechar, quotechar)]
-
             if has_header:
                 discard = next(reader)
 
@@ -411,73 +998,12 @@ def run():
                 else:
                     break
 
-            possible_types = {idx: [int, float, str] for idx in columns_dict.keys()}
-            undetermined_columns = [idx for idx in columns_dict.keys()]
-            nullable_columns = set()
-
-            def eliminate_possible_types(column_idx, row_value):
-                # type: (int, str)->None
-                if row_value in null_values:
-                    return
-
-                decimal_count = row_value.count(".")
-                if decimal_count == 1:
-                    if int in possible_types[column_idx]:
-                        print("\tvalue '%s' eliminated type '%s' for column '%s'" % (
-                        row_value, int, column_names[column_idx]))
-                        possible_types[column_idx].remove(int)
-                elif decimal_count > 1:
-                    if int in possible_types[column_idx]:
-                        print("\tvalue '%s' eliminated type '%s' for column '%s'" % (
-                        row_value, int, column_names[column_idx]))
-                        possible_types[column_idx].remove(int)
-                    if float in possible_types[column_idx]:
-                        print("\tvalue '%s' eliminated type '%s' for column '%s'" % (
-                        row_value, float, column_names[column_idx]))
-                        possible_types[column_idx].remove(float)
-                if not row_value.replace(".", "").isnumeric():
-                    if int in possible_types[column_idx]:
-                        print("\tvalue '%s' eliminated type '%s' for column '%s'" % (
-                        row_value, int, column_names[column_idx]))
-                        possible_types[column_idx].remove(int)
-                    if float in possible_types[column_idx]:
-                        print("\tvalue '%s' eliminated type '%s' for column '%s'" % (
-                        row_value, float, column_names[column_idx]))
-                        possible_types[column_idx].remove(float)
-
-                if len(possible_types[column_idx]) == 1:
-                    if column_idx in undetermined_columns:
-                        print("Finalized type '%s' for column '%s'" % (
-                        possible_types[column_idx][0], column_names[column_idx]))
-                        undetermined_columns.remove(column_idx)
-
-            def identify_nullable_columns(column_idx, row_value):
-                if row_value in null_values:
-                    if column_idx not in nullable_columns:
-                        # print("\tvalue '%s' identified column '%s' as nullable" % (row_value, column_names[column_idx]))
-                        nullable_columns.add(column_idx)
-
-            for row in sample:
-                for column_idx in undetermined_columns:
-                    eliminate_possible_types(column_idx, row[column_idx])
-                for idx, value in enumerate(row):
-                    identify_nullable_columns(idx, value)
-
-            def pick_strictest_type(column_idx):
-                possible = possible_types[column_idx]
-                if int in possible:
-                    return int
-                elif float in possible:
-                    return float
-                elif str in possible:
-                    return str
-                elif len(possible) == 1:
-                    return possible[0]
-                else:
-                    raise ValueError(possible)
-
-            determined_types = {column: pick_strictest_type(column) for column in columns_dict.keys()}
-            return determined_types, nullable_columns
+        inferences = infer_columns(sample, len(column_names), rules)
+        for idx, inference in enumerate(inferences):
+            print("Finalized type '%s' for column '%s'" % (inference.python_type, column_names[idx]))
+        determined_types = {idx: inference.python_type for idx, inference in enumerate(inferences)}
+        nullable_columns = set([idx for idx, inference in enumerate(inferences) if inference.nullable])
+        return determined_types, nullable_columns
 
     column_types, nullable_columns = determine_column_types(sample_size=100000)
     print("Finished determining column types.")
@@ -491,7 +1017,8 @@ def run():
             column_name = "{qc}{cn}{qc}".format(qc=quotechar, cn=column_name)
         is_nullable = idx in nullable_columns
         python_type = column_types[idx]
-        python_to_pg_type = {int: 'INTEGER', float: 'NUMERIC', str: 'TEXT'}
+        python_to_pg_type = {int: 'INTEGER', BigInt: 'BIGINT', float: 'NUMERIC', datetime.date: 'DATE',
+                             datetime.datetime: 'TIMESTAMP', str: 'TEXT'}
         pg_type = python_to_pg_type[python_type]
         nullability = "NULL" if is_nullable else "NOT NULL"
         expression = "{column_name} {pg_type} {nullability}".format(
@@ -519,5 +1046,19 @@ def run():
 
 
 if __name__ == '__main__':
-    run_v2()
+    if not ENCODING.ascii_compatible and (ARGUMENTS.incremental or ARGUMENTS.jobs > 1 or ARGUMENTS.verify_key
+                                          or ARGUMENTS.partition):
+        # these split the file at newline bytes.
+        raise ValueError("'%s' is %s: convert it to UTF-8 for --incremental, --jobs, --verify-key or --partition, "
+                         "e.g. with `iconv -f UTF-16 -t UTF-8`." % (FILE_ARGUMENT, ENCODING.python.upper()))
+    if ARGUMENTS.monitor and not ARGUMENTS.load:
+        raise ValueError("--monitor watches a --load; to watch a COPY run by psql, use copy_monitor.py.")
+    if is_columnar_file(FILE_ARGUMENT):
+        run_columnar()
+    elif ARGUMENTS.load:
+        run_pipelined(ARGUMENTS.load)
+    elif ARGUMENTS.incremental:
+        run_incremental()
+    else:
+        run_v2()
     # run()
@@ -0,0 +1,319 @@
+import os
+import re
+import sys
+import json
+import queue
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from typing import List, Dict, Tuple, Any
+
+from psycopg2.extensions import quote_ident
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core import Manager, PGPassFile, connect
+
+
+# usage: python scripts/schema_to_file.py <server name> <output directory> [schema ...]
+SERVER_NAME = sys.argv[1]
+OUTPUT_DIRECTORY = os.path.normpath(os.path.abspath(sys.argv[2]))
+SCHEMA_ARGUMENTS = sys.argv[3:]
+print(OUTPUT_DIRECTORY)
+
+MAX_CONNECTIONS = 8
+MANIFEST_FILENAME = ".schema_manifest.json"
+
+
+def safe_filename(name):
+    # type: (str)->str
+    """
+    object and schema names may contain anything postgres allows in a quoted identifier. plain lowercase names
+    are used as they are; any other name is made safe and gets a hash of the original, so that `a b` and `a_b`,
+    or `T` and `t` on a case-insensitive file system, don't end up in the same file.
+    """
+    if re.match(r'^[a-z0-9_][a-z0-9_.-]*$', name):
+        return name
+    return "%s__%s" % (re.sub(r'[^A-Za-z0-9_.-]', '_', name), hashlib.sha256(name.encode("utf8")).hexdigest()[:8])
+
+
+class SchemaObject(object):
+    def __init__(self, schema, kind, name, ddl):
+        # type: (str, str, str, str)->None
+        self.schema = schema
+        self.kind = kind
+        self.name = name
+        self.ddl = ddl
+
+    @property
+    def relative_path(self):
+        return os.path.join(safe_filename(self.schema), self.kind, safe_filename(self.name) + ".sql")
+
+    @property
+    def digest(self):
+        return hashlib.sha256(self.ddl.encode("utf8")).hexdigest()
+
+
+class Catalog(object):
+    """ one set-based catalog query per object kind, so the cost per schema doesn't grow with round trips. """
+    columns_query = """
+        SELECT c.relname, c.relkind, a.attname, format_type(a.atttypid, a.atttypmod), a.attnotnull,
+               pg_get_expr(d.adbin, d.adrelid)
+        FROM pg_class c
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        LEFT JOIN pg_attrdef d ON d.adrelid = c.oid AND d.adnum = a.attnum
+        WHERE c.relnamespace = %(schema)s::regnamespace AND c.relkind IN ('r', 'p')
+        ORDER BY c.relname, a.attnum;
+    """
+    partition_keys_query = """
+        SELECT c.relname, pg_get_partkeydef(c.oid)
+        FROM pg_class c
+        WHERE c.relnamespace = %(schema)s::regnamespace AND c.relkind = 'p';
+    """
+    constraints_query = """
+        SELECT c.relname, con.conname, pg_get_constraintdef(con.oid)
+        FROM pg_constraint con
+        JOIN pg_class c ON c.oid = con.conrelid
+        WHERE c.relnamespace = %(schema)s::regnamespace AND c.relkind IN ('r', 'p')
+        ORDER BY c.relname, con.contype DESC, con.conname;
+    """
+    indexes_query = """
+        SELECT i.relname, pg_get_indexdef(i.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_class t ON t.oid = x.indrelid
+        WHERE t.relnamespace = %(schema)s::regnamespace
+          AND NOT EXISTS (
+            SELECT 1 FROM pg_constraint con WHERE con.conindid = x.indexrelid AND con.contype IN ('p', 'u', 'x')
+          );
+    """
+    views_query = """
+        SELECT c.relname, c.relkind, pg_get_viewdef(c.oid)
+        FROM pg_class c
+        WHERE c.relnamespace = %(schema)s::regnamespace AND c.relkind IN ('v', 'm');
+    """
+    sequences_query = """
+        SELECT sequencename, data_type, start_value, min_value, max_value, increment_by, cycle
+        FROM pg_sequences
+        WHERE schemaname = %(schema_name)s;
+    """
+    functions_query = """
+        SELECT p.proname, pg_get_function_identity_arguments(p.oid), pg_get_functiondef(p.oid)
+        FROM pg_proc p
+        WHERE p.pronamespace = %(schema)s::regnamespace AND p.prokind IN ('f', 'p');
+    """
+
+    def __init__(self, cursor, schema):
+        # type: (Any, str)->None
+        self.cursor = cursor
+        self.schema = schema
+
+    def quote(self, identifier):
+        # type: (str)->str
+        """ always quoted, so reserved words like `user` or `order` are safe too. """
+        return quote_ident(identifier, self.cursor)
+
+    def fetch(self, query):
+        # `::regnamespace` parses its input as an identifier, so it takes the quoted name; the views that have
+        # the name as text take it as it is.
+        self.cursor.execute(query, {"schema": self.quote(self.schema), "schema_name": self.schema})
+        return self.cursor.fetchall()
+
+    def tables(self):
+        # type: ()->List[SchemaObject]
+        columns = defaultdict(list)
+        for relname, relkind, attname, type_name, not_null, default in self.fetch(self.columns_query):
+            expression = "    %s %s" % (self.quote(attname), type_name)
+            if default is not None:
+                expression += " DEFAULT %s" % default
+            if not_null:
+                expression += " NOT NULL"
+            columns[relname].append(expression)
+
+        partition_keys = dict(self.fetch(self.partition_keys_query))
+
+        constraints = defaultdict(list)
+        for relname, conname, definition in self.fetch(self.constraints_query):
+            constraints[relname].append("    CONSTRAINT %s %s" % (self.quote(conname), definition))
+
+        objects = list()
+        for relname, expressions in columns.items():
+            ddl = "CREATE TABLE %s.%s (\n%s\n)" % (
+                self.quote(self.schema), self.quote(relname), ",\n".join(expressions + constraints[relname]))
+            if relname in partition_keys:
+                ddl += " PARTITION BY %s" % partition_keys[relname]
+            objects.append(SchemaObject(self.schema, "tables", relname, ddl + ";\n"))
+        return objects
+
+    def indexes(self):
+        # type: ()->List[SchemaObject]
+        return [SchemaObject(self.schema, "indexes", name, definition + ";\n")
+                for name, definition in self.fetch(self.indexes_query)]
+
+    def views(self):
+        # type: ()->List[SchemaObject]
+        objects = list()
+        for relname, relkind, definition in self.fetch(self.views_query):
+            kind, keyword = ("materialized_views", "MATERIALIZED VIEW") if relkind == 'm' else ("views", "VIEW")
+            ddl = "CREATE %s %s.%s AS\n%s\n" % (keyword, self.quote(self.schema), self.quote(relname), definition)
+            objects.append(SchemaObject(self.schema, kind, relname, ddl))
+        return objects
+
+    def sequences(self):
+        # type: ()->List[SchemaObject]
+        objects = list()
+        for name, data_type, start, minimum, maximum, increment, cycle in self.fetch(self.sequences_query):
+            ddl = "CREATE SEQUENCE %s.%s AS %s INCREMENT BY %s MINVALUE %s MAXVALUE %s START WITH %s%s;\n" % (
+                self.quote(self.schema), self.quote(name), data_type, increment, minimum, maximum, start,
+                " CYCLE" if cycle else "")
+            objects.append(SchemaObject(self.schema, "sequences", name, ddl))
+        return objects
+
+    def functions(self):
+        # type: ()->List[SchemaObject]
+        objects = list()
+        for name, arguments, definition in self.fetch(self.functions_query):
+            if arguments:
+                # overloads share a name, so the identity arguments are folded into the filename.
+                name = "%s__%s" % (name, hashlib.sha256(arguments.encode("utf8")).hexdigest()[:8])
+            objects.append(SchemaObject(self.schema, "functions", name, definition.rstrip() + ";\n"))
+        return objects
+
+    def all(self):
+        # type: ()->List[SchemaObject]
+        return self.tables() + self.indexes() + self.views() + self.sequences() + self.functions()
+
+
+class ConnectionPool(object):
+    """
+    a fixed set of connections that all share one exported snapshot, the way `pg_dump --jobs` does,
+    so parallel workers see a consistent catalog.
+    """
+    def __init__(self, server, credential, size):
+        self.connections = list()
+        self.available = queue.Queue()
+        leader = self.open(server, credential)
+        with leader.cursor() as cursor:
+            cursor.execute("SELECT pg_export_snapshot();")
+            snapshot = cursor.fetchone()[0]
+        self.available.put(leader)
+        for _ in range(size - 1):
+            connection = self.open(server, credential)
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION SNAPSHOT %s;", (snapshot,))
+            self.available.put(connection)
+
+    def open(self, server, credential):
+        connection = connect(server, credential, application_name="psql_utils_schema_to_file")
+        connection.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        self.connections.append(connection)
+        return connection
+
+    def run(self, function, *args):
+        connection = self.available.get()
+        try:
+            with connection.cursor() as cursor:
+                return function(cursor, *args)
+        finally:
+            self.available.put(connection)
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+
+
+class Manifest(object):
+    """ remembers the digest of every file written last time, so unchanged objects are not rewritten. """
+    def __init__(self, directory):
+        # type: (str)->None
+        self.filepath = os.path.join(directory, MANIFEST_FILENAME)
+        self.digests = dict()  # type: Dict[str, str]
+        if os.path.isfile(self.filepath):
+            with open(self.filepath, 'r', encoding='utf8') as f:
+                self.digests = json.load(f)
+
+    def save(self, digests):
+        # type: (Dict[str, str])->None
+        with open(self.filepath, 'w', encoding='utf8') as f:
+            json.dump(digests, f, indent=1, sort_keys=True)
+
+
+def list_schemas(cursor):
+    # type: (Any)->List[str]
+    cursor.execute("""
+        SELECT nspname FROM pg_namespace
+        WHERE nspname NOT IN ('pg_catalog', 'information_schema') AND nspname NOT LIKE 'pg\\_%'
+        ORDER BY nspname;
+    """)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def dump_schema(cursor, schema):
+    # type: (Any, str)->List[SchemaObject]
+    return Catalog(cursor, schema).all()
+
+
+def write_objects(objects, manifest, schemas):
+    # type: (List[SchemaObject], Manifest, List[str])->Tuple[int, int, int]
+    """
+    only the files of `schemas` are the business of this run: a run limited to some schemas leaves the files
+    and manifest entries of the others as they are.
+    """
+    written, unchanged, removed = 0, 0, 0
+    digests = dict()
+    for o in objects:
+        path = o.relative_path
+        digest = o.digest
+        digests[path] = digest
+        filepath = os.path.join(OUTPUT_DIRECTORY, path)
+        if manifest.digests.get(path) == digest and os.path.isfile(filepath):
+            unchanged += 1
+            continue
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'w', encoding='utf8') as f:
+            f.write(o.ddl)
+        written += 1
+
+    dumped = set(safe_filename(schema) for schema in schemas)
+    for path, digest in manifest.digests.items():
+        if path in digests:
+            continue
+        if path.split(os.sep, 1)[0] not in dumped:
+            digests[path] = digest
+            continue
+        # objects that were dropped since the last run.
+        filepath = os.path.join(OUTPUT_DIRECTORY, path)
+        if os.path.isfile(filepath):
+            os.remove(filepath)
+        removed += 1
+
+    manifest.save(digests)
+    return written, unchanged, removed
+
+
+def run():
+    server = Manager.Servers()[SERVER_NAME]
+    credentials = PGPassFile().filter(server=server)
+    if not any(credentials):
+        raise KeyError("No credential found for server '%s'" % SERVER_NAME)
+    credential = credentials[0]
+
+    os.makedirs(OUTPUT_DIRECTORY, exist_ok=True)
+    pool = ConnectionPool(server, credential, size=1)
+    try:
+        schemas = SCHEMA_ARGUMENTS or pool.run(list_schemas)
+        pool.close()
+
+        pool = ConnectionPool(server, credential, size=max(1, min(MAX_CONNECTIONS, len(schemas))))
+        print("Dumping %d schema(s) over %d connection(s)..." % (len(schemas), len(pool.connections)))
+        with ThreadPoolExecutor(max_workers=len(pool.connections)) as executor:
+            futures = [executor.submit(pool.run, dump_schema, schema) for schema in schemas]
+            objects = [o for future in futures for o in future.result()]
+    finally:
+        pool.close()
+
+    written, unchanged, removed = write_objects(objects, Manifest(OUTPUT_DIRECTORY), schemas)
+    print("%d objects: %d written, %d unchanged, %d removed." % (len(objects), written, unchanged, removed))
+
+
+if __name__ == '__main__':
+    run()
@@ -1,9 +1,18 @@
 from collections import defaultdict, Counter
 
 from core import Task, Interface, TaskContext, logger, Cancel, TaskResult
+from probe import probe_servers, select_fastest
+from export import export_table, DEFAULT_JOBS
+from copy_table import copy_table, split_table_name
+from psql_runner import run_scripts
+from copy_monitor import CopyMonitor, find_copy_backend
+from progress import Progress, open_with_progress, metrics_file_from_environment
+from inference import infer_columns, SampleConvergence, MAX_SAMPLE_ROWS, BigInt
 from typing import Set, List, Dict, Tuple, Any, Callable
 import os
 import csv
+import glob
+import datetime
 
 
 class TaskSwitch(Task):
@@ -198,85 +207,46 @@ class CreateTableFromCsvTask(Task):
 
         print("Identified the following column names: ", column_names)
 
-        def determine_column_types(sample_size=1000):
-            # type: (int)->Tuple[Dict[int, type], Set[int]]
-            with open(filepath, 'r', **open_kwargs) as f:
+        def determine_column_types(sample_size=1000, batch_size=1024):
+            # type: (int, int)->Tuple[Dict[int, type], Set[int]]
+            """ samples up to `sample_size` rows, but stops once every column's type has settled. """
+            progress = Progress("Sampling %s" % os.path.basename(filepath), metrics_file=metrics_file_from_environment())
+            convergence = SampleConvergence(len(column_names))
+            with open_with_progress(filepath, progress, **open_kwargs) as f:
                 reader = csv.reader(f, **reader_kwargs)
-                null_values = [r"\N", "", "%s%s" % (quotechar, quotechar)]
-
                 if has_header:
                     discard = next(reader)
 
                 sample = []
+                batch = []
                 for row in reader:
-                    if len(sample) < sample_size:
-                        sample.append(row)
-                    else:
-                        break
-
-                possible_types = {idx: [int, float, str] for idx in columns_dict.keys()}
-                undetermined_columns = [idx for idx in columns_dict.keys()]
-                nullable_columns = set()
-
-                def eliminate_possible_types(column_idx, row_value):
-                    # type: (int, str)->None
-                    if row_value in null_values:
-                        return
-
-                    decimal_count = row_value.count(".")
-                    if decimal_count == 1:
-                        if int in possible_types[column_idx]:
-                            print("\tvalue '%s' eliminated type '%s' for column '%s'" % (row_value, int, column_names[column_idx]))
-                            possible_types[column_idx].remove(int)
-                    elif decimal_count > 1:
-                        if int in possible_types[column_idx]:
-                            print("\tvalue '%s' eliminated type '%s' for column '%s'" % (row_value, int, column_names[column_idx]))
-                            possible_types[column_idx].remove(int)
-                        if float in possible_types[column_idx]:
-                            print("\tvalue '%s' eliminated type '%s' for column '%s'" % (row_value, float, column_names[column_idx]))
-                            possible_types[column_idx].remove(float)
-                    if not row_value.replace(".", "").isnumeric():
-                        if int in possible_types[column_idx]:
-                            print("\tvalue '%s' eliminated type '%s' for column '%s'" % (row_value, int, column_names[column_idx]))
-                            possible_types[column_idx].remove(int)
-                        if float in possible_types[column_idx]:
-                            print("\tvalue '%s' eliminated type '%s' for column '%s'" % (row_value, float, column_names[column_idx]))
-                            possible_types[column_idx].remove(float)
-
-                    if len(possible_types[column_idx]) == 1:
-                        if column_idx in undetermined_columns:
-                            print("Finalized type '%s' for column '%s'" % (possible_types[column_idx][0], column_names[column_idx]))
-                            undetermined_columns.remove(column_idx)
-
-                def identify_nullable_columns(column_idx, row_value):
-                    if row_value in null_values:
-                        if column_idx not in nullable_columns:
-                            print("\tvalue '%s' identified column '%s' as nullable" % (row_value, column_names[column_idx]))
-                            nullable_columns.add(column_idx)
-
-                for row in sample:
-                    for column_idx in undetermined_columns:
-                        eliminate_possible_types(column_idx, row[column_idx])
-                    for idx, value in enumerate(row):
-                        identify_nullable_columns(idx, value)
-
-                def pick_strictest_type(column_idx):
-                    possible = possible_types[column_idx]
-                    if int in possible:
-                        return int
-                    elif float in possible:
-                        return float
-                    elif str in possible:
-                        return str
-                    elif len(possible) == 1:
-                        return possible[0]
-                    else:
-                        raise ValueError(possible)
-
-                determined_types = {column: pick_strictest_type(column) for column in columns_dict.keys()}
-                return determined_types, nullable_columns
-
-        column_types, nullable_columns = determine_column_types(sample_size=100000)
+                    batch.append(row)
+                    progress.update()
+                    if len(batch) >= batch_size or len(sample) + len(batch) >= sample_size:
+                        sample += batch
+                        if convergence.add_rows(batch) or len(sample) >= sample_size:
+                            break
+                        batch = []
+                else:
+                    sample += batch
+            progress.finish()
+            if convergence.done:
+                print("Every column's type settled after %d rows." % len(sample))
+
+            progress = Progress("Inferring types", metrics_file=metrics_file_from_environment())
+            inferences = infer_columns(sample, len(column_names))
+            for idx, inference in enumerate(inferences):
+                for rule, n in inference.events.items():
+                    progress.count(column_names[idx], rule, n)
+                print("Finalized type '%s' for column '%s'" % (inference.python_type, column_names[idx]))
+            progress.update(rows=len(sample))
+            progress.finish()
+
+            determined_types = {idx: inference.python_type for idx, inference in enumerate(inferences)}
+            nullable_columns = set([idx for idx, inference in enumerate(inferences) if inference.nullable])
+            return determined_types, nullable_columns
+
+        column_types, nullable_columns = determine_column_types(sample_size=MAX_SAMPLE_ROWS)
         print("Finished determining column types.")
 
         def make_column_expression(idx):
@@ -288,7 +258,8 @@ class CreateTableFromCsvTask(Task):
                 column_name = "{qc}{cn}{qc}".format(qc=quotechar, cn=column_name)
             is_nullable = idx in nullable_columns
             python_type = column_types[idx]
-            python_to_pg_type = {int: 'INTEGER', float: 'NUMERIC', str: 'TEXT'}
+            python_to_pg_type = {int: 'INTEGER', BigInt: 'BIGINT', float: 'NUMERIC', datetime.date: 'DATE',
+                                 datetime.datetime: 'TIMESTAMP', str: 'TEXT'}
             pg_type = python_to_pg_type[python_type]
             nullability = "NULL" if is_nullable else "NOT NULL"
             expression = "{column_name} {pg_type} {nullability}".format(
@@ -303,6 +274,109 @@ COPY x.y FROM '{filepath}' WITH CSV {header} NULL AS '\\N';
         print(ddl)
 
 
+class ProbeServersTask(Task):
+    """
+    connects to every configured server concurrently and reports connect time, latency and write throughput.
+    returns the (Server, PGPassEntry) pair that is best according to `criterion`, so load tasks can call this
+    instead of prompting for a server.
+    """
+    def __init__(self, context, criterion="latency"):
+        # type: (TaskContext, str)->None
+        super().__init__(context)
+        self.criterion = criterion
+
+    def on_call(self, *args, **kwargs):
+        targets = self.context.interface.server_credential_pairs()
+        if not any(targets):
+            logger.error("No servers with credentials are configured.")
+            self.cancel()
+            return
+
+        print("Probing %d server(s)..." % len(targets))
+        results = probe_servers(targets)
+        for result in results:
+            print("\t" + result.to_line())
+
+        best = select_fastest(results, criterion=self.criterion)
+        if best is None:
+            logger.error("None of the configured servers are reachable.")
+            self.cancel()
+            return
+        print("Selected server '%s' (by %s)." % (best.server.name, self.criterion))
+        self.context.done((best.server, best.credential))
+
+
+class ExportTableTask(Task):
+    """ exports a table to CSV over several connections, each streaming its own range of the table. """
+    def on_call(self, *args, **kwargs):
+        server, credential = self.context.interface.select_server_and_user()
+        qualified = input("Enter the table to export (schema.table): ").strip()
+        schema, table = qualified.split(".", 1) if "." in qualified else ("public", qualified)
+        output = os.path.normpath(os.path.abspath(input("Enter the output filepath: ").strip()))
+        jobs = input("Enter the number of connections to use [%d]: " % DEFAULT_JOBS).strip()
+        compress = YesOrNo.call(self, prompt="Compress with gzip? y/n: ").success
+        paths = export_table(server, credential, schema, table, output, jobs=int(jobs) if jobs else DEFAULT_JOBS,
+                             compression="gzip" if compress else None)
+        for path in paths:
+            print("Wrote %s" % path)
+        self.context.done(paths)
+
+
+class CopyTableTask(Task):
+    """ copies a table between two configured servers, streaming the rows from one COPY into the other. """
+    def on_call(self, *args, **kwargs):
+        print("Copy from:")
+        source, source_credential = self.context.interface.select_server_and_user()
+        print("Copy to:")
+        target, target_credential = self.context.interface.select_server_and_user()
+        schema, table = split_table_name(input("Enter the table to copy (schema.table): ").strip())
+        jobs = input("Enter the number of ranges to copy in parallel [1]: ").strip()
+        rows = copy_table(source, source_credential, target, target_credential, schema, table,
+                          jobs=int(jobs) if jobs else 1)
+        print("Copied %d rows." % rows)
+        self.context.done(rows)
+
+
+class RunScriptsTask(Task):
+    """ runs generated .sql files with the psql that matches the server's version, several at a time. """
+    def on_call(self, *args, **kwargs):
+        server, credential = self.context.interface.select_server_and_user()
+        pattern = input("Enter the scripts to run (a path or glob pattern, e.g. /data/*.csv.sql): ").strip()
+        paths = [os.path.abspath(p) for p in sorted(glob.glob(pattern))]
+        if not any(paths):
+            logger.error("No files match: %s" % pattern)
+            self.cancel()
+            return
+        results = run_scripts([(server, credential)], paths)
+        failed = [r for r in results if not r.ok]
+        print("%d script(s): %d ok, %d failed." % (len(results), len(results) - len(failed), len(failed)))
+        self.context.done(results)
+
+
+class MonitorCopyTask(Task):
+    """ watches a COPY FROM another session is running, and appends its performance record to a file. """
+    def on_call(self, *args, **kwargs):
+        server, credential = self.context.interface.select_server_and_user()
+        pid = input("Enter the pid of the loading backend [the first COPY FROM found]: ").strip()
+        pid = int(pid) if pid else find_copy_backend(server, credential)
+        if pid is None:
+            logger.error("No COPY FROM is running on '%s'." % server.name)
+            self.cancel()
+            return
+        record_file = input("Enter the file to append the record to [none]: ").strip()
+        print("Watching backend %d until its session ends; Ctrl-C to stop." % pid)
+        monitor = CopyMonitor(server, credential, pid)
+        try:
+            monitor.run()
+        except KeyboardInterrupt:
+            pass
+        record = monitor.record
+        print(record.to_line())
+        if record_file:
+            record.save(os.path.abspath(record_file))
+        self.context.done(record)
+
+
 class CreateTableTask(TaskSwitch):
     options = [
         (CreateTableFromCsvTask, "From CSV file"),
@@ -312,6 +386,11 @@ class CreateTableTask(TaskSwitch):
 class RootTask(TaskSwitch):
     options = [
         (CreateTableTask, "Create a table from a file"),
+        (ProbeServersTask, "Probe configured servers"),
+        (ExportTableTask, "Export a table to a file"),
+        (CopyTableTask, "Copy a table to another server"),
+        (RunScriptsTask, "Run generated SQL scripts"),
+        (MonitorCopyTask, "Monitor a running COPY"),
     ]
 
 
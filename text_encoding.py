@@ -0,0 +1,95 @@
+import codecs
+from typing import Optional, Any
+
+DEFAULT_HEAD_BYTES = 1 << 20
+
+# bytes 0x80-0x9f are control characters in Latin-1, but letters and punctuation in Windows-1252.
+_WINDOWS_1252_ONLY = bytes(range(0x80, 0xa0))
+
+
+class FileEncoding(object):
+    """
+    how a file's bytes are text: `python` is the codec to decode them with, and `postgres` what to pass
+    to COPY's ENCODING option, or None when COPY can't read the file as it is and it has to be re-encoded.
+    """
+    def __init__(self, python, postgres, bom=b""):
+        # type: (str, Optional[str], bytes)->None
+        self.python = python
+        self.postgres = postgres
+        self.bom = bom
+
+    @property
+    def ascii_compatible(self):
+        # type: ()->bool
+        """ whether newlines, delimiters and quotes are single ASCII bytes, so the file can be split as bytes. """
+        return not self.python.startswith("utf-16")
+
+    @property
+    def codec(self):
+        # type: ()->str
+        """ the codec of the text after the BOM, for reading from the middle of the file. """
+        return "utf8" if self.python == "utf-8-sig" else self.python
+
+    @property
+    def copy_encoding(self):
+        # type: ()->str
+        """ files COPY can't read are re-encoded as UTF-8 on the way. """
+        return self.postgres or "UTF8"
+
+    def __repr__(self):
+        return "FileEncoding(%s, %s)" % (self.python, self.postgres)
+
+
+UTF8 = FileEncoding("utf8", "UTF8")
+
+
+def detect_encoding(filepath, head_bytes=DEFAULT_HEAD_BYTES):
+    # type: (str, int)->FileEncoding
+    """
+    UTF-16 and UTF-8 files with a byte order mark are known by it. otherwise, a head that is valid UTF-8
+    is taken to be UTF-8; one that isn't is Windows-1252 if it has any of the bytes that only that uses,
+    else Latin-1, which can decode anything.
+    postgres has no UTF-16, and COPY would keep a UTF-8 BOM as part of the first value, so neither can be
+    passed to COPY as they are.
+    """
+    with open(filepath, 'rb') as f:
+        head = f.read(head_bytes)
+    for bom, python in [(codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"),
+                        (codecs.BOM_UTF16_BE, "utf-16")]:
+        if head.startswith(bom):
+            return FileEncoding(python, None, bom)
+    try:
+        # the head can end in the middle of a character, which isn't an error yet.
+        codecs.getincrementaldecoder("utf8")().decode(head, final=False)
+        return UTF8
+    except UnicodeDecodeError:
+        pass
+    if any([bytes([c]) in head for c in _WINDOWS_1252_ONLY]):
+        try:
+            head.decode("cp1252")
+            return FileEncoding("cp1252", "WIN1252")
+        except UnicodeDecodeError:
+            # the five bytes Windows-1252 leaves undefined.
+            pass
+    return FileEncoding("latin1", "LATIN1")
+
+
+class Utf8Reader(object):
+    """ a binary file object over another one, that reads its text re-encoded as UTF-8, without any BOM. """
+    def __init__(self, f, encoding):
+        # type: (Any, FileEncoding)->None
+        self.f = f
+        self.decoder = codecs.getincrementaldecoder(encoding.python)()
+        self.pending = b""
+        self.eof = False
+
+    def read(self, size=-1):
+        # type: (int)->bytes
+        while not self.eof and (size < 0 or len(self.pending) < size):
+            data = self.f.read(size if size > 0 else -1)
+            self.eof = not data
+            self.pending += self.decoder.decode(data, final=self.eof).encode("utf8")
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
@@ -0,0 +1,201 @@
+import io
+import os
+import sys
+import csv
+import math
+import zlib
+import shutil
+import argparse
+import tempfile
+from collections import Counter
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Optional
+
+from core import logger
+from csv_index import RowIndex
+from projection import Projection, read_header, is_blank
+
+DEFAULT_MEMORY_BUDGET = 1 << 30
+# how many times its size on disk a spilled partition takes up as a Counter of tuples of python strings.
+EXPANSION = 10
+MAX_PARTITIONS = 256
+MAX_EXAMPLES = 10
+# a partition that is still too big after this many re-splits is mostly one key, and is counted anyway.
+MAX_SPLIT_DEPTH = 3
+SEPARATOR = "\x1f"
+
+
+class UniquenessReport(object):
+    def __init__(self, columns):
+        # type: (List[str])->None
+        self.columns = columns
+        self.rows = 0
+        self.duplicates = 0  # rows whose key already occurred in an earlier row.
+        self.duplicate_keys = 0
+        self.examples = list()  # type: List[Tuple[Tuple[str, ...], int]]
+
+    @property
+    def unique(self):
+        return self.duplicates == 0
+
+    def add(self, rows, duplicates, duplicate_keys, examples):
+        # type: (int, int, int, List[Tuple[Tuple[str, ...], int]])->None
+        self.rows += rows
+        self.duplicates += duplicates
+        self.duplicate_keys += duplicate_keys
+        self.examples = sorted(self.examples + examples, key=lambda e: -e[1])[:MAX_EXAMPLES]
+
+    def print_summary(self):
+        key = ", ".join(self.columns)
+        if self.unique:
+            print("(%s) is unique over all %d rows." % (key, self.rows))
+            return
+        print("(%s) is not unique: %d of %d rows repeat one of %d keys. Most repeated:" % (
+            key, self.duplicates, self.rows, self.duplicate_keys))
+        for values, n in self.examples:
+            print("\t%s x%d" % (", ".join([repr(v) for v in values]), n))
+
+
+def partition_of(values, num_partitions, salt=0):
+    # type: (List[str], int, int)->int
+    # python's hash() of a str differs between processes, so every worker has to agree on crc32 instead.
+    return zlib.crc32(SEPARATOR.join(values).encode("utf8"), salt) % num_partitions
+
+
+def spill_range(filepath, offset, skip, count, indices, num_partitions, directory, worker, delimiter, quotechar,
+                encoding="utf8"):
+    # type: (str, int, int, int, List[int], int, str, int, str, str, str)->int
+    """
+    writes the key of each of `count` rows from `offset` to the spill file of its hash partition. rows are
+    counted like the row index counts them, blank lines included, so that ranges meet exactly; blank lines
+    have no key and aren't spilled.
+    """
+    projection = Projection(indices, delimiter=delimiter, quotechar=quotechar)
+    writers = list()
+    files = list()
+    for p in range(num_partitions):
+        f = open(os.path.join(directory, "p%d.w%d" % (p, worker)), 'w', encoding="utf8", newline="")
+        files.append(f)
+        writers.append(csv.writer(f).writerow)
+    rows = 0
+    with open(filepath, 'rb') as raw:
+        raw.seek(offset)
+        f = io.TextIOWrapper(raw, encoding=encoding, newline="")
+        for record in islice(projection.records(f, skip_blank=False), skip, skip + count):
+            if is_blank(record):
+                continue
+            values = projection.fields(record)
+            writers[partition_of(values, num_partitions)](values)
+            rows += 1
+    for f in files:
+        f.close()
+    return rows
+
+
+def _read_keys(paths):
+    for path in paths:
+        with open(path, 'r', encoding="utf8", newline="") as f:
+            for row in csv.reader(f):
+                yield tuple(row)
+
+
+def count_partition(paths, memory_budget, directory, depth=0):
+    # type: (List[str], int, str, int)->Tuple[int, int, int, List[Tuple[Tuple[str, ...], int]]]
+    """
+    counts the keys of one partition in memory. a partition too big for the budget, because the keys are
+    skewed or the estimate was off, is split again with a different hash first.
+    returns (rows, duplicate rows, duplicated keys, examples).
+    """
+    size = sum([os.path.getsize(p) for p in paths])
+    if size * EXPANSION > memory_budget and depth < MAX_SPLIT_DEPTH:
+        num_parts = min(MAX_PARTITIONS, int(math.ceil(float(size * EXPANSION) / memory_budget)) + 1)
+        sub_paths = [os.path.join(directory, "%s.s%d" % (os.path.basename(paths[0]), p)) for p in range(num_parts)]
+        files = [open(p, 'w', encoding="utf8", newline="") for p in sub_paths]
+        writers = [csv.writer(f).writerow for f in files]
+        for key in _read_keys(paths):
+            writers[partition_of(key, num_parts, salt=depth + 1)](key)
+        for f in files:
+            f.close()
+        result = [0, 0, 0, list()]
+        for p in sub_paths:
+            rows, duplicates, duplicate_keys, examples = count_partition([p], memory_budget, directory, depth + 1)
+            os.remove(p)
+            result = [result[0] + rows, result[1] + duplicates, result[2] + duplicate_keys,
+                      sorted(result[3] + examples, key=lambda e: -e[1])[:MAX_EXAMPLES]]
+        return result[0], result[1], result[2], result[3]
+
+    counts = Counter(_read_keys(paths))
+    repeated = [(key, n) for key, n in counts.items() if n > 1]
+    repeated.sort(key=lambda e: -e[1])
+    return sum(counts.values()), sum([n - 1 for key, n in repeated]), len(repeated), repeated[:MAX_EXAMPLES]
+
+
+def verify_unique(filepath, columns, memory_budget=DEFAULT_MEMORY_BUDGET, workers=None, has_header=True,
+                  delimiter=",", quotechar="\"", directory=None, encoding="utf8"):
+    # type: (str, List[str], int, Optional[int], bool, str, str, Optional[str], str)->UniquenessReport
+    """
+    checks that `columns` hold no key twice over the whole file, with bounded memory.
+    the workers first split the file by row index ranges and spill each key to one of several hash partitions
+    on disk, then count the partitions one at a time each. a duplicate always lands in the same partition as
+    its original, so no partition needs to see another.
+    `memory_budget` is shared by all workers. the row index splits the file on newline bytes, so `encoding`
+    has to be ASCII-compatible.
+    """
+    workers = workers or os.cpu_count() or 1
+    if has_header:
+        header = read_header(filepath, delimiter=delimiter, quotechar=quotechar, encoding=encoding)
+        indices = Projection.from_names(header, columns).indices
+    else:
+        indices = [int(c) for c in columns]
+    index = RowIndex.for_file(filepath, quotechar=quotechar)
+    per_worker_budget = max(1, memory_budget // workers)
+    # keys can't take up more than the whole file.
+    num_partitions = max(workers, min(MAX_PARTITIONS, int(math.ceil(
+        float(index.fingerprint["size"]) * EXPANSION / per_worker_budget))))
+
+    report = UniquenessReport(columns)
+    if not len(index.offsets):
+        # an empty file has no keys to repeat.
+        return report
+
+    # split on indexed rows, so each worker knows where to start and how many rows to read.
+    num_chunks = max(1, min(workers, len(index.offsets)))
+    positions = sorted(set([(i * len(index.offsets)) // num_chunks for i in range(num_chunks)]))
+    ranges = list()
+    for position, next_position in zip(positions, positions[1:] + [None]):
+        first_row = position * index.stride
+        last_row = index.row_count if next_position is None else next_position * index.stride
+        skip = 1 if has_header and first_row == 0 else 0
+        ranges.append((index.offsets[position], skip, last_row - first_row - skip))
+
+    directory = tempfile.mkdtemp(prefix="uniqueness-", dir=directory)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            spilled = list(executor.map(
+                spill_range,
+                *zip(*[(filepath, offset, skip, count, indices, num_partitions, directory, worker, delimiter, quotechar,
+                        encoding) for worker, (offset, skip, count) in enumerate(ranges)])))
+            logger.info("Spilled the keys of %d rows into %d partitions." % (sum(spilled), num_partitions))
+            partitions = [[os.path.join(directory, "p%d.w%d" % (p, w)) for w in range(len(ranges))]
+                          for p in range(num_partitions)]
+            for result in executor.map(count_partition, partitions, [per_worker_budget] * num_partitions,
+                                       [directory] * num_partitions):
+                report.add(*result)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check that a CSV file's key columns are unique over every row.")
+    parser.add_argument("file")
+    parser.add_argument("columns", help="comma-separated names of the key columns.")
+    parser.add_argument("--memory", type=int, default=DEFAULT_MEMORY_BUDGET >> 20, help="MB, shared by all workers.")
+    parser.add_argument("--workers", type=int, default=None, help="default: one per core.")
+    parser.add_argument("--tmp", default=None, help="directory for the spilled partitions.")
+    arguments = parser.parse_args()
+    result = verify_unique(arguments.file, arguments.columns.split(","), memory_budget=arguments.memory << 20,
+                           workers=arguments.workers, directory=arguments.tmp)
+    result.print_summary()
+    sys.exit(0 if result.unique else 1)
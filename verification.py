@@ -0,0 +1,127 @@
+import hashlib
+import datetime
+import decimal
+from typing import List, Dict, Tuple, Any
+
+from inference import parse_value, BigInt
+from incremental import WIDENING_CHAINS
+
+# the python type each generated sql type is parsed as.
+PYTHON_TYPES = {"INTEGER": int, "BIGINT": BigInt, "NUMERIC": decimal.Decimal, "DATE": datetime.date,
+                "TIMESTAMP": datetime.datetime, "TEXT": str}
+
+
+def later_types(sql_type):
+    # type: (str)->List[str]
+    """ the types a column loaded as `sql_type` can still be widened to, itself included. """
+    for chain in WIDENING_CHAINS:
+        if sql_type in chain:
+            return chain[chain.index(sql_type):]
+    return [sql_type, "TEXT"] if sql_type != "TEXT" else ["TEXT"]
+
+
+def pg_text(value):
+    # type: (Any)->str
+    """ what `value::text` returns in postgres, with DateStyle ISO, for the python value of a column. """
+    if isinstance(value, decimal.Decimal):
+        # numeric keeps the scale it was written with, never uses an exponent, and has no negative zero.
+        return format(abs(value) if value == 0 else value, "f")
+    if isinstance(value, datetime.datetime):
+        text = value.strftime("%Y-%m-%d %H:%M:%S")
+        return text + (".%06d" % value.microsecond).rstrip("0") if value.microsecond else text
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value)
+
+
+def canonical(value, loaded_as, shown_as):
+    # type: (str, str, str)->str
+    """ the text of a CSV value loaded into a `loaded_as` column, once the column is `shown_as`. """
+    if loaded_as == "TEXT":
+        return value
+    if loaded_as == "NUMERIC":
+        typed = decimal.Decimal(value)
+    else:
+        typed = parse_value(PYTHON_TYPES[loaded_as], value)
+    if shown_as == "NUMERIC" and not isinstance(typed, decimal.Decimal):
+        typed = decimal.Decimal(typed)
+    elif shown_as == "TIMESTAMP" and not isinstance(typed, datetime.datetime):
+        typed = datetime.datetime.combine(typed, datetime.time())
+    return pg_text(typed)
+
+
+def value_hash(text):
+    # type: (str)->int
+    """ the first 8 bytes of the md5 as a signed integer, as `('x' || left(md5(text), 16))::bit(64)::bigint`. """
+    return int.from_bytes(hashlib.md5(text.encode("utf8")).digest()[:8], "big", signed=True)
+
+
+class ColumnChecksum(object):
+    """
+    an order-independent checksum of one column: the number of non-null values and the sum of their hashes.
+    the column's type can still be widened after values are added, which changes their text (1.50 stays 1.50,
+    but 2024-01-31 becomes 2024-01-31 00:00:00), so a sum is kept for every type the column might end up as.
+    """
+    def __init__(self, name):
+        # type: (str)->None
+        self.name = name
+        self.values = 0
+        self.sums = dict()  # type: Dict[str, int]
+
+    def add_counts(self, value_counts, loaded_as, null_values):
+        # type: (Dict[str, int], str, List[str])->None
+        """ each distinct value is converted and hashed once per type, however often it occurs. """
+        shown = later_types(loaded_as)
+        sums = [0] * len(shown)
+        for value, n in value_counts.items():
+            if value in null_values:
+                continue
+            self.values += n
+            for i, shown_as in enumerate(shown):
+                sums[i] += n * value_hash(canonical(value, loaded_as, shown_as))
+        for shown_as, total in zip(shown, sums):
+            self.sums[shown_as] = self.sums.get(shown_as, 0) + total
+
+    def sum_as(self, sql_type):
+        # type: (str)->int
+        return self.sums.get(sql_type, 0)
+
+
+class LoadChecksum(object):
+    def __init__(self, column_names, null_values):
+        # type: (List[str], List[str])->None
+        self.columns = [ColumnChecksum(name) for name in column_names]
+        self.null_values = null_values
+        self.rows = 0
+
+    def add(self, rows, column_counts, loaded_as):
+        # type: (int, List[Dict[str, int]], List[str])->None
+        """ `column_counts` has the value counts of each column of `rows` rows, loaded as the types `loaded_as`. """
+        self.rows += rows
+        for column, counts, sql_type in zip(self.columns, column_counts, loaded_as):
+            column.add_counts(counts, sql_type, self.null_values)
+
+    def server_query(self, target):
+        # type: (str)->str
+        """ one scan of the loaded table that computes the same checksums. """
+        expressions = ["count(*)"]
+        for column in self.columns:
+            quoted = '"%s"' % column.name.replace('"', '""')
+            expressions.append("count(%s)" % quoted)
+            expressions.append("coalesce(sum(('x' || left(md5(%s::text), 16))::bit(64)::bigint::numeric), 0)" % quoted)
+        return "SELECT %s FROM %s;" % (", ".join(expressions), target)
+
+    def compare(self, server_row, final_types):
+        # type: (Tuple, List[str])->List[str]
+        """ the differences between the server's result row and the client's checksums, one line each. """
+        mismatches = list()
+        if server_row[0] != self.rows:
+            mismatches.append("rows: %d in the file, %d in the table" % (self.rows, server_row[0]))
+        for i, (column, sql_type) in enumerate(zip(self.columns, final_types)):
+            values, total = server_row[1 + 2 * i], server_row[2 + 2 * i]
+            if values != column.values:
+                mismatches.append("%s: %d non-null values in the file, %d in the table" % (
+                    column.name, column.values, values))
+            elif int(total) != column.sum_as(sql_type):
+                mismatches.append("%s: the checksums of the values differ" % column.name)
+        return mismatches